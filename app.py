@@ -1,102 +1,16 @@
+import time
 import streamlit as st
-from src.pdf_ingest import ingest_pdfs
-from src.generate import generate_enriched_response, get_section_labels_for_agency
+from src.generate import get_section_labels_for_agency
 from src.utils import get_llm
+from src.jobs import get_job_queue
+from src.tracing import timing_rows
+from src.export import build_full_draft, generate_pdf, generate_word_doc
 from langchain.chains import ConversationChain
 from langchain.memory import ConversationBufferMemory
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from io import BytesIO
-from docx import Document
 
 # Page Config ────────────────────────────────
 st.set_page_config(page_title="Grant Facilities Draft Generator", layout="wide")
 
-# Utility Function ───────────────────────────
-def build_full_draft(sections_dict, section_labels):
-    final = ""
-    for section_label in section_labels:
-        section_text = sections_dict.get(section_label, "").strip()
-        if section_text:
-            final += f"\n\n## {section_label}\n\n{section_text}\n"
-    return final.strip()
-
-def generate_pdf(sections_dict, section_labels, sources):
-    """Generate a PDF from the sections and sources"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    story = []
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1 
-    )
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        spaceBefore=20
-    )
-    normal_style = styles['Normal']
-    
-    # Add title
-    story.append(Paragraph("Facilities Template", title_style))
-    story.append(Spacer(1, 20))
-    
-    # Add sections
-    for section_label in section_labels:
-        section_text = sections_dict.get(section_label, "").strip()
-        if section_text:
-            story.append(Paragraph(section_label, heading_style))
-            story.append(Paragraph(section_text, normal_style))
-            story.append(Spacer(1, 12))
-    
-
-    if sources:
-        story.append(Paragraph("Sources Used", heading_style))
-        for source in sources:
-            story.append(Paragraph(f"• {source}", normal_style))
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
-
-def generate_word_doc(sections_dict, section_labels, sources):
-    """Generate a Word document from the sections and sources"""
-    doc = Document()
-    
-    # Add sections (no title)
-    for section_label in section_labels:
-        section_text = sections_dict.get(section_label, "").strip()
-        if section_text:
-            # Add section heading
-            doc.add_heading(section_label, level=1)
-            
-            # Add section content
-            doc.add_paragraph(section_text)
-            
-            # Add some spacing
-            doc.add_paragraph()
-    
-    # Add sources if available
-    if sources:
-        doc.add_heading("Sources Used", level=1)
-        for source in sources:
-            doc.add_paragraph(f"• {source}", style='List Bullet')
-    
-    # Save to BytesIO
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
-
 # Session State Init ─────────────────────────
 if "conversation_chain" not in st.session_state:
     memory = ConversationBufferMemory()
@@ -121,6 +35,12 @@ if "sources" not in st.session_state:
 if "section_labels" not in st.session_state:
     st.session_state.section_labels = []
 
+if "last_trace" not in st.session_state:
+    st.session_state.last_trace = []
+
+if "loaded_draft_job" not in st.session_state:
+    st.session_state.loaded_draft_job = None
+
 # undo functionality session state
 if "section_edit_history" not in st.session_state:
     st.session_state.section_edit_history = {}
@@ -131,6 +51,12 @@ if "section_original_content" not in st.session_state:
 if "section_edit_messages" not in st.session_state:
     st.session_state.section_edit_messages = {}
 
+# Background Jobs ────────────────────────────
+# Drafts and reindexing run on shared background workers; their job ids live
+# in the URL so progress and results survive reruns and page reloads.
+jobs = get_job_queue()
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
 # Layout ─────────────────────────────────────
 left, right = st.columns([1, 2])
 
@@ -139,8 +65,15 @@ with left:
     st.title("Grant Facilities Section Form")
 
     if st.button("Reindex PDFs in `/data` folder"):
-        ingest_pdfs()
+        st.query_params["ingest_job"] = jobs.submit("ingest", {"data_folder": "data"})
+
+    ingest_job = jobs.get(st.query_params["ingest_job"]) if "ingest_job" in st.query_params else None
+    if ingest_job and ingest_job["status"] in ACTIVE_JOB_STATUSES:
+        st.progress(ingest_job["progress"] or 0.0, text=ingest_job["message"] or "Reindex queued...")
+    elif ingest_job and ingest_job["status"] == "done":
         st.success("Reindex complete!")
+    elif ingest_job and ingest_job["status"] == "failed":
+        st.error(f"Reindex failed: {ingest_job['error']}")
     
     st.markdown("### Select Files to Search:")
     selected_agency = st.radio(
@@ -170,41 +103,61 @@ with left:
                 st.markdown(f"<div style=' color: black;'>{label}</div>", unsafe_allow_html=True)
                 user_inputs[label] = st.text_area(label, height=100, key=f"input_{label}", label_visibility="hidden")
             submitted = st.form_submit_button("Generate Section")
+            regenerate = st.form_submit_button("Regenerate", help="Draft every section again instead of reusing cached sections")
     else:
         
         user_inputs = {}
         submitted = False
+        regenerate = False
 
-    if submitted:
+    if submitted or regenerate:
         if not selected_agency:
             st.error("Please select files to search before generating.")
         else:
-            with st.spinner("Generating and validating..."):
-                
-                section_outputs, sources = generate_enriched_response(user_inputs, selected_types=selected_types)
+            st.query_params["draft_job"] = jobs.submit(
+                "draft", {"user_inputs": user_inputs, "selected_types": selected_types, "use_cache": not regenerate}
+            )
 
-            if not section_outputs:
-                st.warning("Please fill out the form to generate your Facilities Template.")
-            else:
-                st.session_state.enriched_sections = section_outputs
-                st.session_state.final_draft = build_full_draft(section_outputs, section_labels)
-                st.session_state.sources = sources
-                st.session_state.section_labels = section_labels  # Store section labels
-                st.session_state.draft_generated = True
-                
-                for section, content in section_outputs.items():
-                    st.session_state.section_original_content[section] = content
-                    st.session_state.section_edit_history[section] = []
+    draft_job = jobs.get(st.query_params["draft_job"]) if "draft_job" in st.query_params else None
+    if draft_job and draft_job["status"] == "failed":
+        st.error(f"Draft failed: {draft_job['error']}")
+    elif draft_job and draft_job["status"] == "done" and st.session_state.loaded_draft_job != draft_job["id"]:
+        st.session_state.loaded_draft_job = draft_job["id"]
+        section_outputs = draft_job["result"]["section_outputs"]
+        draft_labels = get_section_labels_for_agency(draft_job["params"]["selected_types"])
+        st.session_state.last_trace = draft_job["result"]["trace"]
+
+        if not section_outputs:
+            st.warning("Please fill out the form to generate your Facilities Template.")
+        else:
+            st.session_state.enriched_sections = section_outputs
+            st.session_state.final_draft = build_full_draft(section_outputs, draft_labels)
+            st.session_state.sources = draft_job["result"]["sources_used"]
+            st.session_state.section_labels = draft_labels  # Store section labels
+            st.session_state.draft_generated = True
 
-                st.session_state.conversation_chain.memory.chat_memory.clear()
-                st.session_state.conversation_chain.memory.chat_memory.add_user_message(
-                    "This is the final enriched document:\n" + st.session_state.final_draft
-                )
-                st.session_state.chat_history.clear()
-                st.success("Draft complete!")
+            for section, content in section_outputs.items():
+                st.session_state.section_original_content[section] = content
+                st.session_state.section_edit_history[section] = []
+
+            st.session_state.conversation_chain.memory.chat_memory.clear()
+            st.session_state.conversation_chain.memory.chat_memory.add_user_message(
+                "This is the final enriched document:\n" + st.session_state.final_draft
+            )
+            st.session_state.chat_history.clear()
+            st.success("Draft complete!")
 
 with right:
-    if st.session_state.draft_generated:
+    if draft_job and draft_job["status"] in ACTIVE_JOB_STATUSES:
+        # Sections appear here as the background job streams them
+        st.markdown("### Drafting Sections...")
+        st.progress(draft_job["progress"] or 0.0, text=draft_job["message"] or "Waiting for a free worker...")
+        partial = (draft_job["result"] or {}).get("section_outputs", {})
+        for label in get_section_labels_for_agency(draft_job["params"]["selected_types"]):
+            if partial.get(label):
+                st.markdown(f"## {label}\n\n{partial[label]}")
+
+    elif st.session_state.draft_generated:
         #st.markdown("### Download PDF")
         
         if "show_filename_input" not in st.session_state:
@@ -357,6 +310,11 @@ with right:
             else:
                 st.markdown(f"- {s}")
 
+        # Timing ───────────────────────────────
+        if st.session_state.last_trace:
+            with st.expander("Timing", expanded=False):
+                st.dataframe(timing_rows(st.session_state.last_trace), use_container_width=True, hide_index=True)
+
     # Follow-up Chat ──────────────────────────
     st.markdown("### Follow-up Chat")
 
@@ -379,3 +337,8 @@ with right:
     for user_q, bot_a in st.session_state.chat_history:
         st.markdown(f"**You:** {user_q}")
         st.markdown(f"**Assistant:** {bot_a}")
+
+# Poll Running Jobs ──────────────────────────
+if any(job and job["status"] in ACTIVE_JOB_STATUSES for job in (draft_job, ingest_job)):
+    time.sleep(0.5)
+    st.rerun()
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from src.clients import get_config
+from src.export import generate_pdf, generate_word_doc
+from src.generate import generate_enriched_response, get_section_labels_for_agency
+from src.rate_limit import RateLimiter, is_rate_limit_error, retry_after_seconds
+
+DEFAULT_BATCH_CONFIG = {
+    "concurrency": 4,
+    "drafts_per_minute": 30,
+    "max_retries": 3
+}
+
+# Items already marked done in the checkpoint are skipped on the next run
+CHECKPOINT_FILENAME = "checkpoint.jsonl"
+
+def _selected_types(record):
+    if record.get("selected_types"):
+        return [agency.upper() for agency in record["selected_types"]]
+    if record.get("agency"):
+        return [record["agency"].strip().upper()]
+    return []
+
+def load_batch(path):
+    """
+    Read batch items from JSONL or CSV.
+
+    JSONL: one {"id", "agency" (or "selected_types"), "inputs": {section label: text}} per line.
+    CSV:   columns "id", "agency" and one column per section label.
+    Items without an id are numbered by position.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            records = [
+                {
+                    "id": row.pop("id", None),
+                    "agency": row.pop("agency", None),
+                    "inputs": {label: text for label, text in row.items() if text}
+                }
+                for row in csv.DictReader(f)
+            ]
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    items = []
+    for n, record in enumerate(records, start=1):
+        selected_types = _selected_types(record)
+        labels = get_section_labels_for_agency(selected_types)
+        items.append({
+            "id": str(record.get("id") or f"item-{n}"),
+            "selected_types": selected_types,
+            "user_inputs": {label: record.get("inputs", {}).get(label, "") for label in labels}
+        })
+
+    ids = [item["id"] for item in items]
+    duplicates = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate batch item ids: {', '.join(duplicates)}")
+    return items
+
+def load_checkpoint(path):
+    """Latest checkpoint record per item id."""
+    records = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["id"]] = record
+    return records
+
+def append_checkpoint(path, record, lock):
+    with lock, open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _safe_filename(item_id):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", item_id)
+
+def draft_item(item, config_path, limiter, max_retries):
+    """Generate one proposal's sections, backing off only on 429 responses."""
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return generate_enriched_response(
+                item["user_inputs"],
+                selected_types=item["selected_types"],
+                config_path=config_path
+            )
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            delay = retry_after_seconds(e, attempt)
+            print(f"  Rate limit hit on {item['id']}, pausing drafts for {delay:.1f}s (attempt {attempt + 1} of {max_retries + 1})")
+            limiter.pause(delay)
+
+def write_outputs(item, section_outputs, sources, output_dir, formats):
+    """Write the draft with the same builders the app uses; returns the file paths."""
+    section_labels = get_section_labels_for_agency(item["selected_types"])
+    base = os.path.join(output_dir, _safe_filename(item["id"]))
+    paths = []
+    if "docx" in formats:
+        with open(f"{base}.docx", "wb") as f:
+            f.write(generate_word_doc(section_outputs, section_labels, sources).getvalue())
+        paths.append(f"{base}.docx")
+    if "pdf" in formats:
+        with open(f"{base}.pdf", "wb") as f:
+            f.write(generate_pdf(section_outputs, section_labels, sources).getvalue())
+        paths.append(f"{base}.pdf")
+    return paths
+
+def process_item(item, config_path, output_dir, formats, limiter, max_retries):
+    """Draft and export one item, returning its checkpoint record. Never raises."""
+    start = time.perf_counter()
+    record = {"id": item["id"]}
+    try:
+        section_outputs, sources = draft_item(item, config_path, limiter, max_retries)
+        if not section_outputs:
+            raise ValueError("no non-empty sections for the selected agency")
+        record.update(
+            status="done",
+            sections=section_outputs,
+            sources=sources,
+            outputs=write_outputs(item, section_outputs, sources, output_dir, formats)
+        )
+    except Exception as e:
+        record.update(status="failed", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return record
+
+def run_batch(input_path, output_dir="batch_output", config_path="src/config.yaml", concurrency=None,
+              formats=("docx", "pdf")):
+    """
+    Draft every item in `input_path`, resuming from the checkpoint in `output_dir`.
+    Failed items are recorded and retried on the next run; they do not stop the batch.
+    """
+    batch_config = {**DEFAULT_BATCH_CONFIG, **get_config(config_path).get("batch", {})}
+    concurrency = concurrency or batch_config["concurrency"]
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILENAME)
+
+    items = load_batch(input_path)
+    done = {i for i, record in load_checkpoint(checkpoint_path).items() if record["status"] == "done"}
+    pending = [item for item in items if item["id"] not in done]
+
+    print("=" * 80)
+    print("BATCH DRAFTING")
+    print("=" * 80)
+    print(f"{len(items)} items, {len(items) - len(pending)} already done, {len(pending)} to draft "
+          f"({concurrency} at a time, {batch_config['drafts_per_minute']} drafts/min)")
+
+    limiter = RateLimiter(batch_config["drafts_per_minute"])
+    lock = threading.Lock()
+    results = {"done": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(process_item, item, config_path, output_dir, formats, limiter, batch_config["max_retries"])
+            for item in pending
+        ]
+        for n, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            append_checkpoint(checkpoint_path, record, lock)
+            results[record["status"]] += 1
+            detail = ", ".join(record["outputs"]) if record["status"] == "done" else record["error"]
+            print(f"  [{n}/{len(pending)}] {record['id']}: {record['status']} in {record['seconds']}s ({detail})")
+
+    print(f"\nDone: {results['done']}  Failed: {results['failed']}  Skipped (already done): {len(items) - len(pending)}")
+    if results["failed"]:
+        print("Re-run the same command to retry failed items.")
+    print(f"Checkpoint: {checkpoint_path}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draft facilities sections for many proposals from a JSONL or CSV file")
+    parser.add_argument("input", help="JSONL or CSV file of form inputs")
+    parser.add_argument("--output-dir", default="batch_output", help="where drafts and the checkpoint are written")
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--concurrency", type=int, default=None, help="drafts in flight at once (default: batch.concurrency)")
+    parser.add_argument("--formats", nargs="+", choices=["docx", "pdf"], default=["docx", "pdf"])
+    args = parser.parse_args()
+    run_batch(args.input, args.output_dir, args.config, args.concurrency, args.formats)
@@ -0,0 +1,21 @@
+import argparse
+from src.clients import get_config, get_vectordb
+from src.numpy_store import DTYPES, export_numpy_store, numpy_store_dtype, numpy_store_path
+
+def export_store(config_path="src/config.yaml", output_dir=None, dtype=None):
+    """Export the Chroma collection to the NumPy vector store used by `retrieval.backend: numpy`"""
+    config = get_config(config_path)
+    output_dir = output_dir or numpy_store_path(config)
+    dtype = dtype or numpy_store_dtype(config)
+    count = export_numpy_store(get_vectordb(config_path)._collection, output_dir, dtype)
+    print(f"Exported {count} chunks to {output_dir} ({dtype} first pass)")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the Chroma collection to a memory-mapped NumPy store")
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--output-dir", default=None, help="defaults to retrieval.numpy_store_path or <persist_directory>/numpy_store")
+    parser.add_argument("--dtype", choices=DTYPES, default=None,
+                        help="first-pass vectors; float16 / int8 are rescored with float32 (default: retrieval.numpy_store_dtype)")
+    args = parser.parse_args()
+    export_store(args.config, args.output_dir, args.dtype)
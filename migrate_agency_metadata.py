@@ -0,0 +1,30 @@
+import os
+from src.clients import get_config, get_vectordb, invalidate_clients
+from src.lexical_index import get_lexical_index, lexical_index_path
+from src.numpy_store import export_numpy_store, numpy_store_dtype, numpy_store_path
+from src.pdf_ingest import backfill_agency
+
+def backfill_agency_metadata(config_path="src/config.yaml", batch_size=500):
+    """Add the normalized `agency` field to every chunk that is missing it or has it wrong"""
+    
+    collection = get_vectordb(config_path)._collection
+    print(f"Chunks in collection: {collection.count()}")
+    updated = backfill_agency(collection, batch_size)
+    print(f"Chunks updated: {updated}")
+    
+    # Derived indexes carry the agency too, so rebuild them from the collection
+    config = get_config(config_path)
+    if updated and os.path.exists(lexical_index_path(config)):
+        lexical = get_lexical_index(config)
+        if lexical.count():
+            lexical.backfill(collection)
+    if updated and os.path.exists(os.path.join(numpy_store_path(config), "chunks.json")):
+        export_numpy_store(collection, numpy_store_path(config), numpy_store_dtype(config))
+
+    invalidate_clients(config_path)
+    print("Agency backfill complete.")
+    
+    return updated
+
+if __name__ == "__main__":
+    backfill_agency_metadata()
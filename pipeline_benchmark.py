@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import yaml
+from src.generate import generate_enriched_response, get_section_labels_for_agency
+from src.tracing import start_trace
+from src.utils import read_yaml_as_dict
+
+# Fixed form inputs replayed on every run so results are comparable across commits
+BENCHMARK_INPUTS = [
+    {
+        "name": "nsf_hpc_lab",
+        "selected_types": ["NSF"],
+        "user_inputs": {
+            "1. Project Title": "Scalable learning for city-scale wireless networks",
+            "2. Research Space and Facilities": "Our lab occupies 1,200 sq ft in the Brooklyn engineering building with 12 workstations.",
+            "3. Core Instrumentation": "Software-defined radios and a 64-antenna massive MIMO array.",
+            "4. Computing and Data Resources": "We use NYU's HPC system with GPU nodes and 200 TB of project storage.",
+            "5a. Internal Facilities (NYU)": "Access to the NYU Greene cluster and research computing support.",
+            "5b. External Facilities (Other Institutions)": "COSMOS wireless testbed in West Harlem.",
+            "6. Special Infrastructure": "Rooftop antenna mounts and fiber to the campus data center."
+        }
+    },
+    {
+        "name": "nsf_robotics_partial",
+        "selected_types": ["NSF"],
+        "user_inputs": {
+            "2. Research Space and Facilities": "Our Robotics Lab has 10 industrial arms and a motion capture system.",
+            "4. Computing and Data Resources": "We train policies on GPU servers in the lab and on the NYU HPC cluster.",
+            "5a. Internal Facilities (NYU)": "NYU HPC for large simulation sweeps."
+        }
+    },
+    {
+        "name": "nih_imaging_core",
+        "selected_types": ["NIH"],
+        "user_inputs": {
+            "1. Project Title": "Longitudinal imaging of neural circuit development",
+            "2. Research Space and Facilities": "Wet lab space with tissue culture hoods and a BSL-2 suite.",
+            "3. Core Instrumentation": "Two-photon microscope and a confocal imaging system.",
+            "4. Computing and Data Resources": "Image analysis on the NYU HPC cluster with 50 TB storage.",
+            "5a. Internal Facilities (NYU)": "Shared high performance computing and data storage at NYU.",
+            "6. Special Infrastructure": "Animal facility with imaging-ready housing.",
+            "7. Equipment": "Vibratome, cryostat and a high-speed camera."
+        }
+    }
+]
+
+STAGES = ["retrieval", "web_search", "prompt_build", "llm"]
+
+# Response caches switched off for every run: with them on, the warm-up and
+# first pass fill them and later runs time cache hits instead of generation
+DISABLED_CACHES = ["section_cache", "web_cache", "embedding_cache"]
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return {"n": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "n": len(values),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2)
+    }
+
+PROMPT_KEYS = ["prompt_tokens", "context_tokens_before", "context_tokens_after", "tokens_saved"]
+
+def benchmark_stages(config_path, repeats):
+    """
+    Per-stage and per-section latency plus prompt sizes, read from the spans
+    generate_enriched_response already emits. Stage spans start after the
+    provider limits are acquired, so they exclude queueing; section spans are
+    wall time for the section, sections running concurrently as in the app.
+    Retrieval is batched per draft, so its samples are per draft.
+    """
+    stage_samples = {stage: [] for stage in STAGES}
+    section_samples = {}
+    prompt_reports = []
+    cached_tokens = []
+
+    for repeat in range(repeats):
+        print(f"  Stage pass {repeat + 1}/{repeats}...")
+        for item in BENCHMARK_INPUTS:
+            with start_trace("benchmark_stages", enabled=True) as trace:
+                run_draft(item, config_path)
+            for record in trace.summary():
+                name, attributes = record["name"], record["attributes"]
+                seconds = record["duration_ms"] / 1000
+                if name in stage_samples:
+                    stage_samples[name].append(seconds)
+                if name == "section":
+                    section_samples.setdefault(attributes["section"], []).append(seconds)
+                elif name == "prompt_build":
+                    prompt_reports.append(attributes)
+                elif name == "llm":
+                    cached_tokens.append(attributes.get("cached_tokens") or 0)
+
+    prompt_tokens = {
+        key: round(float(np.mean([r[key] for r in prompt_reports])), 1)
+        for key in PROMPT_KEYS
+    }
+    prompt_tokens["cached_tokens"] = round(float(np.mean(cached_tokens)), 1)
+    return (
+        {stage: summarize(samples) for stage, samples in stage_samples.items()},
+        {section: summarize(samples) for section, samples in sorted(section_samples.items())},
+        prompt_tokens
+    )
+
+def run_draft(item, config_path):
+    start = time.perf_counter()
+    generate_enriched_response(item["user_inputs"], selected_types=item["selected_types"], config_path=config_path)
+    return time.perf_counter() - start
+
+def benchmark_end_to_end(config_path, repeats):
+    """Latency of generate_enriched_response for each fixed input"""
+    samples = []
+    per_input = {}
+    for repeat in range(repeats):
+        print(f"  End-to-end pass {repeat + 1}/{repeats}...")
+        for item in BENCHMARK_INPUTS:
+            seconds = run_draft(item, config_path)
+            samples.append(seconds)
+            per_input.setdefault(item["name"], []).append(seconds)
+    return {
+        "all": summarize(samples),
+        "per_input": {name: summarize(values) for name, values in per_input.items()}
+    }
+
+def benchmark_concurrency(config_path, users, drafts_per_user):
+    """Throughput and latency with `users` drafts in flight at once"""
+    jobs = [BENCHMARK_INPUTS[i % len(BENCHMARK_INPUTS)] for i in range(users * drafts_per_user)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        latencies = list(executor.map(lambda item: run_draft(item, config_path), jobs))
+    elapsed = time.perf_counter() - start
+
+    sections = sum(
+        sum(1 for label in get_section_labels_for_agency(item["selected_types"]) if item["user_inputs"].get(label, "").strip())
+        for item in jobs
+    )
+    return {
+        "users": users,
+        "drafts": len(jobs),
+        "wall_seconds": round(elapsed, 3),
+        "drafts_per_second": round(len(jobs) / elapsed, 3),
+        "sections_per_second": round(sections / elapsed, 3),
+        "latency": summarize(latencies)
+    }
+
+def uncached_config(config_path):
+    """Path to a temporary copy of `config_path` with DISABLED_CACHES turned off"""
+    config = read_yaml_as_dict(config_path)
+    for block in DISABLED_CACHES:
+        config[block] = {**(config.get(block) or {}), "enabled": False}
+    fd, path = tempfile.mkstemp(prefix="benchmark_config_", suffix=".yaml")
+    with os.fdopen(fd, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+def run_pipeline_benchmark(config_path="src/config.yaml", repeats=3, users=(1, 4, 8), drafts_per_user=2,
+                           filename="pipeline_benchmark.json"):
+    """Benchmark the drafting pipeline and save the results as JSON"""
+
+    print("=" * 80)
+    print("PIPELINE LATENCY BENCHMARK")
+    print("=" * 80)
+
+    print(f"Caches disabled for all runs: {', '.join(DISABLED_CACHES)}")
+    run_config = uncached_config(config_path)
+    try:
+        # Warm-up so process-wide clients are built before anything is timed
+        run_draft(BENCHMARK_INPUTS[0], run_config)
+
+        stages, sections, prompt_tokens = benchmark_stages(run_config, repeats)
+        end_to_end = benchmark_end_to_end(run_config, repeats)
+        concurrency = []
+        for n in users:
+            print(f"  Concurrency: {n} users...")
+            concurrency.append(benchmark_concurrency(run_config, n, drafts_per_user))
+    finally:
+        os.remove(run_config)
+
+    results = {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config_path": config_path,
+        "disabled_caches": DISABLED_CACHES,
+        "repeats": repeats,
+        "inputs": [item["name"] for item in BENCHMARK_INPUTS],
+        "stages": stages,
+        "sections": sections,
+        "prompt_tokens": prompt_tokens,
+        "end_to_end": end_to_end,
+        "concurrency": concurrency
+    }
+
+    # FINAL SUMMARY
+    print(f"\n" + "=" * 80)
+    print("FINAL SUMMARY")
+    print("=" * 80)
+    for stage, summary in stages.items():
+        print(f"{stage:>14}: p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms")
+    print(f"{'prompt':>14}: {prompt_tokens['prompt_tokens']} tokens/section, "
+          f"{prompt_tokens['cached_tokens']} cached, "
+          f"{prompt_tokens['tokens_saved']} context tokens saved/section")
+    print(f"{'end_to_end':>14}: p50 {end_to_end['all']['p50_ms']} ms  p95 {end_to_end['all']['p95_ms']} ms  p99 {end_to_end['all']['p99_ms']} ms")
+    for run in concurrency:
+        print(f"{run['users']:>3} users: {run['drafts_per_second']} drafts/s, p95 {run['latency']['p95_ms']} ms")
+
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results saved to: {filename}")
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency benchmark for the drafting pipeline")
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--repeats", type=int, default=3, help="passes over the fixed inputs")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 8], help="concurrent user counts to test")
+    parser.add_argument("--drafts-per-user", type=int, default=2)
+    parser.add_argument("--output", default="pipeline_benchmark.json", help="where to write the JSON results")
+    args = parser.parse_args()
+    run_pipeline_benchmark(args.config, args.repeats, args.users, args.drafts_per_user, args.output)
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+from pipeline_benchmark import current_commit, summarize
+from retriever_drift import DRIFT_QUERIES
+from src.clients import get_config, get_shared_embedding_model, get_vectordb
+from src.numpy_store import DTYPES, NumpyStore, export_numpy_store, numpy_store_files, write_numpy_store
+from vector_backend_benchmark import make_queries
+
+def first_pass_files(path, dtype):
+    """Files a search reads in full: the first-pass vectors plus their norms (and int8 scales)"""
+    files = numpy_store_files(path)
+    names = ["vectors" if dtype == "float32" else f"vectors.{dtype}", "norms"] + (["scales"] if dtype == "int8" else [])
+    return [files[name] for name in names]
+
+def cold_load_seconds(path, dtype):
+    """Read the first-pass arrays from disk after dropping them from the page cache"""
+    files = first_pass_files(path, dtype)
+    for name in files:
+        fd = os.open(name, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    start = time.perf_counter()
+    for name in files:
+        np.load(name)
+    return time.perf_counter() - start
+
+def recall_at_k(store, reference, queries, k, agencies):
+    """Mean overlap of each query's top-k with the exact float32 top-k, and per-query latency"""
+    recalls, samples = [], []
+    for query, expected in zip(queries, reference):
+        start = time.perf_counter()
+        _, ids, _ = store.search([query], k, agencies)[0]
+        samples.append(time.perf_counter() - start)
+        recalls.append(len(set(ids) & set(expected)) / max(1, len(expected)))
+    return round(float(np.mean(recalls)), 4) if recalls else None, samples
+
+def evaluate_store(ids, documents, metadatas, vectors, space, query_sets, k, rescore_candidates, dtypes):
+    """Export one corpus at every dtype and compare each against the exact float32 store"""
+    workdir = tempfile.mkdtemp(prefix="quantized_store_")
+    try:
+        exact = None
+        rows = []
+        for dtype in ("float32",) + tuple(d for d in dtypes if d != "float32"):
+            path = os.path.join(workdir, dtype)
+            write_numpy_store(path, ids, documents, metadatas, vectors, space, dtype)
+            load_seconds = cold_load_seconds(path, dtype)
+            store = NumpyStore(path, rescore_candidates)
+            first_pass_only = NumpyStore(path, k)
+            if exact is None:
+                exact = store
+                references = {
+                    name: [ids for _, ids, _ in exact.search(queries, k, agencies)]
+                    for name, (queries, agencies) in query_sets.items()
+                }
+
+            row = {
+                "dtype": dtype,
+                "memory_bytes": store.memory_bytes(),
+                "bytes_per_chunk": round(store.memory_bytes() / max(1, len(ids)), 1),
+                "disk_bytes": sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)),
+                "cold_load_ms": round(load_seconds * 1000, 3),
+                "recall": {},
+                "first_pass_recall": {}
+            }
+            samples = []
+            for name, (queries, agencies) in query_sets.items():
+                row["recall"][name], latency = recall_at_k(store, references[name], queries, k, agencies)
+                row["first_pass_recall"][name], _ = recall_at_k(first_pass_only, references[name], queries, k, agencies)
+                samples.extend(latency)
+            row["query"] = summarize(samples)
+            rows.append(row)
+
+        baseline = rows[0]
+        for row in rows:
+            row["memory_reduction"] = round(baseline["memory_bytes"] / row["memory_bytes"], 2)
+            row["cold_load_speedup"] = round(baseline["cold_load_ms"] / max(row["cold_load_ms"], 1e-6), 2)
+        return rows
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def print_rows(rows):
+    print(f"{'dtype':>8} {'bytes/chunk':>12} {'memory':>8} {'cold load':>12} {'query p50':>10}  recall@k (first pass only)")
+    for row in rows:
+        recall = ", ".join(
+            f"{name} {row['recall'][name]} ({row['first_pass_recall'][name]})" for name in row["recall"]
+        )
+        print(f"{row['dtype']:>8} {row['bytes_per_chunk']:>12} {row['memory_reduction']:>7}x "
+              f"{row['cold_load_ms']:>9} ms {row['query']['p50_ms']:>7} ms  {recall}")
+
+def run_quantization_report(config_path="src/config.yaml", dtypes=DTYPES, k=5, n_queries=100,
+                            synthetic_size=0, filename="quantization_report.json"):
+    """Recall, memory and cold-load time of the float16 / int8 stores against float32"""
+
+    print("=" * 80)
+    print("QUANTIZED STORE REPORT")
+    print("=" * 80)
+
+    config = get_config(config_path)
+    rescore_candidates = config.get("retrieval", {}).get("rescore_candidates", 40)
+
+    export_dir = tempfile.mkdtemp(prefix="numpy_store_")
+    try:
+        export_numpy_store(get_vectordb(config_path)._collection, export_dir)
+        source = NumpyStore(export_dir)
+        vectors = np.asarray(source.vectors)
+        query_sets = {
+            # the drift analysis queries, embedded as the app embeds them
+            "drift": (get_shared_embedding_model(config_path).embed_documents(DRIFT_QUERIES), ["NSF"]),
+            "neighbours": (make_queries(vectors, n_queries), None)
+        }
+        print(f"  Configured store: {len(source.ids)} chunks x {vectors.shape[1]}...")
+        configured = evaluate_store(
+            source.ids, source.documents, source.metadatas, vectors, source.space,
+            query_sets, k, rescore_candidates, dtypes
+        )
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+    synthetic = None
+    if synthetic_size:
+        # projected corpus size: random unit vectors of the same dimension
+        print(f"  Synthetic corpus: {synthetic_size} x {vectors.shape[1]}...")
+        rng = np.random.default_rng(0)
+        synthetic_vectors = rng.normal(size=(synthetic_size, vectors.shape[1])).astype(np.float32)
+        synthetic_vectors /= np.linalg.norm(synthetic_vectors, axis=1, keepdims=True)
+        synthetic = evaluate_store(
+            [f"chunk-{i}" for i in range(synthetic_size)],
+            [""] * synthetic_size,
+            [{"agency": "NSF"}] * synthetic_size,
+            synthetic_vectors,
+            "l2",
+            {"neighbours": (make_queries(synthetic_vectors, n_queries, seed=1), None)},
+            k, rescore_candidates, dtypes
+        )
+
+    results = {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config_path": config_path,
+        "k": k,
+        "rescore_candidates": rescore_candidates,
+        "configured_store": configured,
+        "synthetic": synthetic
+    }
+
+    # FINAL SUMMARY
+    print(f"\n" + "=" * 80)
+    print("FINAL SUMMARY")
+    print("=" * 80)
+    print(f"Configured store ({len(source.ids)} chunks), recall@{k} against exact float32 "
+          f"with {rescore_candidates} rescored candidates:")
+    print_rows(configured)
+    if synthetic:
+        print(f"\nSynthetic corpus ({synthetic_size} chunks):")
+        print_rows(synthetic)
+
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results saved to: {filename}")
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs memory of the quantized NumPy vector store")
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--dtypes", nargs="+", choices=DTYPES, default=list(DTYPES))
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=100, help="neighbour queries (perturbed stored vectors)")
+    parser.add_argument("--synthetic-size", type=int, default=0, help="also report a random corpus of this many chunks")
+    parser.add_argument("--output", default="quantization_report.json", help="where to write the JSON results")
+    args = parser.parse_args()
+    run_quantization_report(args.config, tuple(args.dtypes), args.k, args.queries, args.synthetic_size, args.output)
@@ -1,12 +1,18 @@
 
 
+import argparse
 import json
 import numpy as np
 from collections import Counter
-from sklearn.metrics.pairwise import cosine_similarity
-from langchain.vectorstores import Chroma
-from src.utils import get_embedding_model, read_yaml_as_dict
-from src.retriever import search_similar_chunks
+from src.clients import get_shared_embedding_model, get_vectordb
+from src.retriever import search_similar_chunks_with_vectors
+from src.analysis import mean_cross_group_similarity, unique_vectors_by_id
+
+# Queries tracked across drift runs
+DRIFT_QUERIES = [
+    "New York University high performance computing",
+    "COSMOS Wireless Testbed HPC clusters"
+]
 
 def calculate_jaccard_similarity(set_a, set_b):
     """Calculate Jaccard similarity between two sets"""
@@ -52,80 +58,47 @@ def calculate_source_stability(runs):
     stability = 100 * np.mean(jaccard_scores)
     return round(stability, 2)
 
-def calculate_cross_run_content_stability(runs, embedding_model):
-    """Calculate cross-run content stability using cosine similarity"""
-    if len(runs) < 2:
+def calculate_cross_run_content_stability(run_ids, run_vectors):
+    """Calculate cross-run content stability using cosine similarity of the stored chunk vectors"""
+    if len(run_vectors) < 2:
         return 100.0
     
     try:
-        print("  Calculating embeddings for cross-run content stability...")
-        
-        # Get embeddings for all chunks across all runs
-        all_embeddings = []
-        run_boundaries = []  # Track where each run starts/ends
-        
-        start_idx = 0
-        for run_idx, run in enumerate(runs):
-            run_embeddings = []
-            for chunk_idx, doc in enumerate(run):
-                embedding = embedding_model.embed_query(doc.page_content)
-                all_embeddings.append(embedding)
-                run_embeddings.append(embedding)
-            
-            run_boundaries.append((start_idx, start_idx + len(run_embeddings)))
-            start_idx += len(run_embeddings)
-        
-        # Convert to numpy array
-        embeddings_array = np.array(all_embeddings)
+        # Chunks retrieved in several runs share one row
+        unique_vectors, run_indices = unique_vectors_by_id(run_ids, run_vectors)
+        print(f"  Using stored vectors for {len(unique_vectors)} unique chunks")
         
-        # Calculate pairwise similarities between all runs
-        cross_run_similarities = []
-        
-        for a in range(len(runs)):
-            for b in range(a + 1, len(runs)):
-                start_a, end_a = run_boundaries[a]
-                start_b, end_b = run_boundaries[b]
-                
-                # Get embeddings for run a and run b
-                run_a_embeddings = embeddings_array[start_a:end_a]
-                run_b_embeddings = embeddings_array[start_b:end_b]
-                
-                # Calculate cosine similarity between the two runs
-                similarity_matrix = cosine_similarity(run_a_embeddings, run_b_embeddings)
-                
-                # Take the mean of all pairwise similarities
-                avg_similarity = np.mean(similarity_matrix)
-                cross_run_similarities.append(avg_similarity)
-        
-        if not cross_run_similarities:
-            return 100.0
-        
-        stability = 100 * np.mean(cross_run_similarities)
+        # Mean similarity between every pair of runs, from one similarity matrix
+        stability = 100 * mean_cross_group_similarity(unique_vectors, run_indices)
         return round(stability, 2)
         
     except Exception as e:
         print(f"  Error calculating cross-run content stability: {e}")
         return 0.0
 
-def calculate_improved_retriever_drift(query, num_runs=5, k=5, selected_types=['NSF']):
+def calculate_improved_retriever_drift(query, num_runs=5, k=5, selected_types=['NSF'], config_path="src/config.yaml"):
     """Calculate retriever drift using valid metrics"""
     
     print(f" Running query '{query}' {num_runs} times...")
     
     # Store results from each run
     runs = []
+    run_ids = []
+    run_vectors = []
     
     for run in range(num_runs):
         print(f"  Run {run + 1}/{num_runs}...")
         
-        # Get retrieval results
-        retrieved_docs = search_similar_chunks(query, k=k, selected_types=selected_types)
+        # Get retrieval results along with their stored vectors
+        retrieved_docs, ids, vectors = search_similar_chunks_with_vectors(query, k=k, selected_types=selected_types, config_path=config_path)
         
         if not retrieved_docs:
             print(f"    No results in run {run + 1}")
             continue
         
         runs.append(retrieved_docs)
+        run_ids.append(ids)
+        run_vectors.append(vectors)
         print(f"    Retrieved {len(retrieved_docs)} chunks")
     
     if len(runs) < 2:
@@ -145,8 +118,7 @@ def calculate_improved_retriever_drift(query, num_runs=5, k=5, selected_types=['
     source_stability = calculate_source_stability(runs)
     
     # Calculate content stability
-    embedding_model = get_embedding_model("src/config.yaml")
-    content_stability = calculate_cross_run_content_stability(runs, embedding_model)
+    content_stability = calculate_cross_run_content_stability(run_ids, run_vectors)
     
     # Calculate drift percentages (inverse of stability)
     id_drift = 100 - id_stability
@@ -165,7 +137,7 @@ def calculate_improved_retriever_drift(query, num_runs=5, k=5, selected_types=['
         'runs_data': runs
     }
 
-def analyze_improved_retriever_drift():
+def analyze_improved_retriever_drift(config_path="src/config.yaml", filename="retriever_drift_analysis(2).json"):
     """Analyze retriever drift using valid metrics"""
     
     print("=" * 80)
@@ -174,9 +146,7 @@ def analyze_improved_retriever_drift():
     print("Using valid drift metrics: ID stability, source stability, content stability...")
     
     # Initialize
-    config = read_yaml_as_dict("src/config.yaml")
-    persist_dir = config["chroma"]["persist_directory"]
-    vectordb = Chroma(persist_directory=persist_dir, embedding_function=get_embedding_model("src/config.yaml"))
+    vectordb = get_vectordb(config_path)
     
     # Get NSF data summary
     try:
@@ -195,10 +165,7 @@ def analyze_improved_retriever_drift():
     print(f"Unique NSF sources: {len(set(item.get('source', 'unknown') for item in nsf_data))}")
     
     # Test queries
-    test_queries = [
-        "New York University high performance computing",
-        "COSMOS Wireless Testbed HPC clusters"
-    ]
+    test_queries = DRIFT_QUERIES
     
     drift_results = {}
     
@@ -211,7 +178,7 @@ def analyze_improved_retriever_drift():
         print("-" * 60)
         
         # Calculate drift for this query
-        drift_data = calculate_improved_retriever_drift(query, num_runs=5, k=5, selected_types=['NSF'])
+        drift_data = calculate_improved_retriever_drift(query, num_runs=5, k=5, selected_types=['NSF'], config_path=config_path)
         
         drift_results[query] = drift_data
         
@@ -242,6 +209,10 @@ def analyze_improved_retriever_drift():
         print(f"  Content Drift: {results['content_drift']}%")
         print()
     
+    embedding_model = get_shared_embedding_model(config_path)
+    if hasattr(embedding_model, "stats"):
+        print(f"Embedding cache: {embedding_model.stats()}")
+    
     # Save results
     final_results = {
         'nsf_data_summary': {
@@ -264,8 +235,6 @@ def analyze_improved_retriever_drift():
     }
     
     # Save to JSON
-    filename = "retriever_drift_analysis(2).json"
-    
     with open(filename, 'w') as f:
         json.dump(final_results, f, indent=2, default=str)
     
@@ -274,4 +243,8 @@ def analyze_improved_retriever_drift():
     return final_results
 
 if __name__ == "__main__":
-    analyze_improved_retriever_drift()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--output", default="retriever_drift_analysis(2).json", help="where to write the JSON results")
+    args = parser.parse_args()
+    analyze_improved_retriever_drift(config_path=args.config, filename=args.output)
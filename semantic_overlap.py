@@ -1,43 +1,29 @@
+import argparse
 import json
+import re
 import numpy as np
 from collections import Counter
-from sklearn.metrics.pairwise import cosine_similarity
-from langchain.vectorstores import Chroma
-from src.utils import get_embedding_model, read_yaml_as_dict
-from src.retriever import search_similar_chunks
+from src.clients import get_shared_embedding_model, get_vectordb
+from src.prompt_builder import count_tokens
+from src.retriever import search_similar_chunks_with_vectors
+from src.analysis import mean_pairwise_similarity
 
-def calculate_semantic_overlap(chunks, embedding_model):
-    """Calculate semantic overlap using embeddings and cosine similarity"""
-    if len(chunks) < 2:
+# Re-embedding a stored chunk with the model that built the store reproduces
+# its vector almost exactly; a different model lands far from it
+EMBEDDER_MATCH_THRESHOLD = 0.95
+
+def calculate_semantic_overlap(chunk_vectors):
+    """Calculate semantic overlap using the stored chunk embeddings and cosine similarity"""
+    if len(chunk_vectors) < 2:
         return 0.0
     
     try:
-        # Get embeddings for all chunks
-        print(" Calculating embeddings...")
-        embeddings = []
-        for i, chunk in enumerate(chunks):
-            embedding = embedding_model.embed_query(chunk.page_content)
-            embeddings.append(embedding)
-            print(f"    Chunk {i+1}: {len(embedding)} dimensions")
-        
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings)
+        print(f" Using stored vectors: {len(chunk_vectors)} chunks, {chunk_vectors.shape[1]} dimensions")
         
-        # Calculate pairwise cosine similarities
+        # Average pairwise cosine similarity, excluding self-similarity
         print(" Computing cosine similarities...")
-        similarity_matrix = cosine_similarity(embeddings_array)
-        
-        # Calculate average similarity (excluding self-similarity)
-        # Sum all similarities, subtract diagonal (self-similarity), divide by number of comparisons
-        total_similarity = similarity_matrix.sum()
-        self_similarity = np.trace(similarity_matrix)  # Sum of diagonal
-        num_comparisons = len(chunks) * (len(chunks) - 1)  # Exclude self-comparisons
-        
-        if num_comparisons > 0:
-            avg_similarity = (total_similarity - self_similarity) / num_comparisons
-            return round(avg_similarity * 100, 2)  # Convert to percentage
-        else:
-            return 0.0
+        avg_similarity = mean_pairwise_similarity(chunk_vectors, np.arange(len(chunk_vectors)))
+        return round(avg_similarity * 100, 2)  # Convert to percentage
             
     except Exception as e:
         print(f" Error calculating semantic overlap: {e}")
@@ -53,7 +39,59 @@ def calculate_source_diversity(chunks):
     diversity_percentage = (unique_sources / total_chunks) * 100
     return round(diversity_percentage, 2)
 
-def analyze_semantic_overlap():
+def calculate_duplicate_tokens(chunks):
+    """Tokens of sentences that already appeared in an earlier chunk, e.g. from splitter overlap"""
+    seen = set()
+    duplicate_tokens = 0
+    for doc in chunks:
+        for sentence in re.split(r"(?<=[.!?])\s+|\n+", doc.page_content):
+            key = " ".join(sentence.lower().split())
+            if not key:
+                continue
+            if key in seen:
+                duplicate_tokens += count_tokens(sentence)
+            seen.add(key)
+    return duplicate_tokens
+
+def check_query_embedder(embedding_model, vectordb, samples=3):
+    """
+    Mean cosine similarity between a few stored chunk vectors and the same
+    chunks re-embedded with the configured model, or None when the
+    dimensions differ. Low values mean queries and store use different models.
+    """
+    stored = vectordb._collection.get(limit=samples, include=["documents", "embeddings"])
+    if not stored["ids"]:
+        return None
+    stored_vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    query_vectors = np.asarray(embedding_model.embed_documents(stored["documents"]), dtype=np.float32)
+    if query_vectors.shape != stored_vectors.shape:
+        return None
+    norms = np.linalg.norm(stored_vectors, axis=1) * np.linalg.norm(query_vectors, axis=1)
+    similarities = (stored_vectors * query_vectors).sum(axis=1) / np.where(norms == 0, 1, norms)
+    return round(float(similarities.mean()), 4)
+
+def analyze_retrieval(query, config_path, mmr):
+    """Overlap, diversity and prompt-token statistics of one query's top-5 NSF chunks"""
+    retrieved_docs, _, retrieved_vectors = search_similar_chunks_with_vectors(
+        query, k=5, selected_types=['NSF'], config_path=config_path, mmr=mmr
+    )
+    if not retrieved_docs:
+        return None, None
+
+    sources = [doc.metadata.get('source', 'unknown') for doc in retrieved_docs]
+    return retrieved_docs, {
+        'retrieved_count': len(retrieved_docs),
+        'unique_sources': len(set(sources)),
+        'semantic_overlap': calculate_semantic_overlap(retrieved_vectors),
+        'source_diversity': calculate_source_diversity(retrieved_docs),
+        'context_tokens': sum(count_tokens(doc.page_content) for doc in retrieved_docs),
+        'duplicate_tokens': calculate_duplicate_tokens(retrieved_docs),
+        'sources': sources,
+        'source_distribution': dict(Counter(sources))
+    }
+
+def analyze_semantic_overlap(config_path="src/config.yaml", filename="semantic_overlap_analysis(2).json",
+                             allow_embedder_mismatch=False):
     """Analyze semantic overlap for NSF queries"""
     
     print("=" * 80)
@@ -61,10 +99,19 @@ def analyze_semantic_overlap():
     print("=" * 80)
     
     # Initialize
-    config = read_yaml_as_dict("src/config.yaml")
-    persist_dir = config["chroma"]["persist_directory"]
-    embedding_model = get_embedding_model("src/config.yaml")
-    vectordb = Chroma(persist_directory=persist_dir, embedding_function=embedding_model)
+    embedding_model = get_shared_embedding_model(config_path)
+    vectordb = get_vectordb(config_path)
+    
+    # Queries embedded with a different model than the store rank chunks
+    # arbitrarily, so the overlap numbers would mean nothing
+    embedder_similarity = check_query_embedder(embedding_model, vectordb)
+    print(f"Query embedder vs store vectors: cosine {embedder_similarity}")
+    if embedder_similarity is None or embedder_similarity < EMBEDDER_MATCH_THRESHOLD:
+        print("The configured embedding model did not build this store (e.g. hashing embeddings "
+              "against an ada-002 store); retrieval results are not meaningful.")
+        if not allow_embedder_mismatch:
+            print("Use the store's embedding model, or pass --allow-embedder-mismatch to run anyway.")
+            return
     
     # Get all metadata
     try:
@@ -110,42 +157,28 @@ def analyze_semantic_overlap():
         print(f"\n Query: '{query}'")
         print("-" * 60)
         
-        # Get retrieval results for NSF only
-        retrieved_docs = search_similar_chunks(query, k=5, selected_types=['NSF'])
+        # Get retrieval results for NSF only: plain top-5, then the MMR-reranked top-5
+        retrieved_docs, results = analyze_retrieval(query, config_path, mmr=False)
         
         if not retrieved_docs:
             print(f" No results found")
             continue
         
         print(f"Retrieved: {len(retrieved_docs)} chunks")
+        mmr_docs, results['mmr'] = analyze_retrieval(query, config_path, mmr=True)
+        query_results[query] = results
         
-        # Calculate semantic overlap
-        semantic_overlap = calculate_semantic_overlap(retrieved_docs, embedding_model)
-        
-        # Calculate source diversity
-        source_diversity = calculate_source_diversity(retrieved_docs)
-        
-        # Get source files
-        sources = [doc.metadata.get('source', 'unknown') for doc in retrieved_docs]
-        source_counts = Counter(sources)
-        
-        query_results[query] = {
-            'retrieved_count': len(retrieved_docs),
-            'unique_sources': len(set(sources)),
-            'semantic_overlap': semantic_overlap,
-            'source_diversity': source_diversity,
-            'sources': sources,
-            'source_distribution': dict(source_counts)
-        }
-        
-        print(f"SEMANTIC OVERLAP: {semantic_overlap}%")
-        print(f"Source Diversity: {source_diversity}%")
-        print(f"Unique Sources: {len(set(sources))}")
-        print(f"Source Distribution: {dict(source_counts)}")
+        for label, stats in (("Top-k", results), ("MMR", results['mmr'])):
+            print(f"{label}:")
+            print(f"  SEMANTIC OVERLAP: {stats['semantic_overlap']}%")
+            print(f"  Source Diversity: {stats['source_diversity']}%")
+            print(f"  Unique Sources: {stats['unique_sources']}")
+            print(f"  Context Tokens: {stats['context_tokens']} ({stats['duplicate_tokens']} duplicate)")
+            print(f"  Source Distribution: {stats['source_distribution']}")
         
         # Show chunk previews
-        print(f"Chunk Previews:")
-        for i, doc in enumerate(retrieved_docs, 1):
+        print(f"Chunk Previews (MMR):")
+        for i, doc in enumerate(mmr_docs, 1):
             preview = doc.page_content[:100] + "..." if len(doc.page_content) > 100 else doc.page_content
             print(f"    {i}. {preview}")
     
@@ -155,14 +188,20 @@ def analyze_semantic_overlap():
     print("=" * 80)
     
     for query, results in query_results.items():
-        print(f"'{query}':")
-        print(f"  Semantic Overlap: {results['semantic_overlap']}%")
-        print(f"  Source Diversity: {results['source_diversity']}%")
-        print(f"  Unique Sources: {results['unique_sources']}")
+        mmr = results['mmr']
+        print(f"'{query}':  (top-k -> MMR)")
+        print(f"  Semantic Overlap: {results['semantic_overlap']}% -> {mmr['semantic_overlap']}%")
+        print(f"  Source Diversity: {results['source_diversity']}% -> {mmr['source_diversity']}%")
+        print(f"  Unique Sources: {results['unique_sources']} -> {mmr['unique_sources']}")
+        print(f"  Duplicate Tokens: {results['duplicate_tokens']} -> {mmr['duplicate_tokens']}")
         print()
     
+    if hasattr(embedding_model, "stats"):
+        print(f"Embedding cache: {embedding_model.stats()}")
+    
     # Save results
     final_results = {
+        'embedder_similarity': embedder_similarity,
         'nsf_data_summary': {
             'total_chunks': len(nsf_data),
             'unique_sources': len(set(item['metadata'].get('source', 'unknown') for item in nsf_data))
@@ -173,16 +212,19 @@ def analyze_semantic_overlap():
                 'unique_sources': results['unique_sources'],
                 'semantic_overlap': results['semantic_overlap'],
                 'source_diversity': results['source_diversity'],
+                'context_tokens': results['context_tokens'],
+                'duplicate_tokens': results['duplicate_tokens'],
                 'sources': results['sources'],
-                'source_distribution': results['source_distribution']
+                'source_distribution': results['source_distribution'],
+                'mmr': results['mmr'],
+                'overlap_reduction': round(results['semantic_overlap'] - results['mmr']['semantic_overlap'], 2),
+                'duplicate_tokens_saved': results['duplicate_tokens'] - results['mmr']['duplicate_tokens']
             }
             for query, results in query_results.items()
         }
     }
     
     # Save to JSON
-    filename = "semantic_overlap_analysis(2).json"
-    
     with open(filename, 'w') as f:
         json.dump(final_results, f, indent=2, default=str)
     
@@ -191,4 +233,11 @@ def analyze_semantic_overlap():
     return final_results
 
 if __name__ == "__main__":
-    analyze_semantic_overlap()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--output", default="semantic_overlap_analysis(2).json", help="where to write the JSON results")
+    parser.add_argument("--allow-embedder-mismatch", action="store_true",
+                        help="run even when the query embedder differs from the store's")
+    args = parser.parse_args()
+    analyze_semantic_overlap(config_path=args.config, filename=args.output,
+                             allow_embedder_mismatch=args.allow_embedder_mismatch)
@@ -0,0 +1,77 @@
+"""
+Shared helpers for the retrieval analysis scripts.
+
+Retrieved chunks repeat heavily across runs, so their stored embeddings are
+collapsed by chunk ID and every similarity statistic is computed from a
+single cosine matrix over the unique chunks. Nothing is re-embedded, and cost
+scales with the number of distinct chunks rather than runs x k.
+"""
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """Return `matrix` with each row scaled to unit length (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def cosine_similarity_matrix(a, b=None):
+    """Pairwise cosine similarity between the rows of `a` and `b` (default `a`)."""
+    a = normalize_rows(a)
+    b = a if b is None else normalize_rows(b)
+    return a @ b.T
+
+
+def mean_pairwise_similarity(vectors, index):
+    """
+    Mean cosine similarity over all ordered pairs of distinct items, where item i
+    has embedding vectors[index[i]].
+    """
+    n = len(index)
+    if n < 2:
+        return 0.0
+    similarity = cosine_similarity_matrix(vectors)
+    counts = np.bincount(index, minlength=len(vectors)).astype(np.float32)
+    total = counts @ similarity @ counts
+    self_similarity = counts @ np.diag(similarity)
+    return float((total - self_similarity) / (n * (n - 1)))
+
+
+def mean_cross_group_similarity(vectors, group_indices):
+    """
+    For every pair of groups (a < b), average cosine similarity between the items
+    of a and the items of b; return the mean over all pairs.
+    `group_indices[g]` holds the rows of `vectors` for group g.
+    """
+    groups = [np.asarray(g, dtype=np.intp) for g in group_indices if len(g)]
+    if len(groups) < 2:
+        return 1.0
+
+    similarity = cosine_similarity_matrix(vectors)
+    membership = np.stack([np.bincount(g, minlength=len(vectors)) for g in groups]).astype(np.float32)
+    sizes = membership.sum(axis=1)
+
+    pair_sums = membership @ similarity @ membership.T
+    pair_means = pair_sums / np.outer(sizes, sizes)
+    upper = np.triu_indices(len(groups), k=1)
+    return float(pair_means[upper].mean())
+
+
+def unique_vectors_by_id(group_ids, group_vectors):
+    """
+    Collapse stored chunk vectors that share an ID across groups.
+    Returns (unique_vectors, group_indices) for `mean_cross_group_similarity`.
+    """
+    position = {}
+    rows = []
+    group_indices = []
+    for ids, vectors in zip(group_ids, group_vectors):
+        indices = []
+        for chunk_id, vector in zip(ids, vectors):
+            if chunk_id not in position:
+                position[chunk_id] = len(rows)
+                rows.append(vector)
+            indices.append(position[chunk_id])
+        group_indices.append(np.array(indices, dtype=np.intp))
+    return np.asarray(rows, dtype=np.float32), group_indices
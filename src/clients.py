@@ -0,0 +1,66 @@
+"""
+Process-wide registry of long-lived clients.
+
+Building an embedding model and opening a persistent Chroma store are both
+expensive (config read, HTTP client setup, SQLite open and HNSW load), so
+they are created once per process and shared between callers and threads.
+Call `invalidate_clients()` whenever the store on disk has been rewritten,
+e.g. after `ingest_pdfs`, so the next caller reopens a fresh handle.
+"""
+import threading
+from langchain.vectorstores import Chroma
+from src.utils import get_embedding_model, read_yaml_as_dict
+
+_lock = threading.RLock()
+_configs = {}
+_embedding_models = {}
+_vectordbs = {}
+
+
+def get_config(config_path="src/config.yaml"):
+    """Return the parsed config for `config_path`, reading the file only once."""
+    with _lock:
+        if config_path not in _configs:
+            _configs[config_path] = read_yaml_as_dict(config_path)
+        return _configs[config_path]
+
+
+def get_shared_embedding_model(config_path="src/config.yaml"):
+    """Return the shared embedding model for `config_path`."""
+    with _lock:
+        if config_path not in _embedding_models:
+            _embedding_models[config_path] = get_embedding_model(config_path)
+        return _embedding_models[config_path]
+
+
+def get_vectordb(config_path="src/config.yaml", persist_directory=None):
+    """Return the shared Chroma handle for (config_path, persist_directory)."""
+    if persist_directory is None:
+        persist_directory = get_config(config_path)["chroma"]["persist_directory"]
+
+    key = (config_path, persist_directory)
+    with _lock:
+        if key not in _vectordbs:
+            _vectordbs[key] = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=get_shared_embedding_model(config_path)
+            )
+        return _vectordbs[key]
+
+
+def invalidate_clients(config_path=None):
+    """
+    Drop cached clients so they are rebuilt on next use.
+    With no `config_path` every cached client is dropped.
+    """
+    with _lock:
+        if config_path is None:
+            _configs.clear()
+            _embedding_models.clear()
+            _vectordbs.clear()
+            return
+
+        _configs.pop(config_path, None)
+        _embedding_models.pop(config_path, None)
+        for key in [key for key in _vectordbs if key[0] == config_path]:
+            del _vectordbs[key]
@@ -0,0 +1,121 @@
+"""
+Persistent embedding cache.
+
+Wraps an embedding model so every text is embedded at most once per model:
+vectors are stored in SQLite as float32 blobs keyed by (model name, sha256
+of the text). Re-ingests and repeated analysis runs then only pay for text
+the cache has not seen yet.
+"""
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.tracing import span
+
+# Keep IN (...) lists under SQLite's bound-parameter limit
+_LOOKUP_BATCH = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an on-disk cache."""
+
+    def __init__(self, embeddings, cache_path, model_name=None):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", type(embeddings).__name__)
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def _lookup(self, hashes):
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), _LOOKUP_BATCH):
+                batch = hashes[i:i + _LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch]
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, hashes, vectors):
+        rows = [
+            (self.model_name, h, np.asarray(v, dtype=np.float32).tobytes())
+            for h, v in zip(hashes, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        with span("embedding", texts=len(texts)) as s:
+            hashes = [text_hash(t) for t in texts]
+            found = self._lookup(list(set(hashes)))
+
+            # embed each unseen text once, even if it repeats within `texts`
+            missing = {}
+            for h, t in zip(hashes, texts):
+                if h not in found and h not in missing:
+                    missing[h] = t
+
+            if missing:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+                self._store(list(missing.keys()), vectors)
+                found.update(zip(missing.keys(), vectors))
+
+            with self._lock:
+                self.hits += len(texts) - len(missing)
+                self.misses += len(missing)
+            s.set(cache_hits=len(texts) - len(missing), cache_misses=len(missing))
+
+            return [list(found[h]) for h in hashes]
+
+    def embed_query(self, text):
+        with span("embedding", texts=1) as s:
+            h = text_hash(text)
+            found = self._lookup([h])
+            if h in found:
+                with self._lock:
+                    self.hits += 1
+                s.set(cache_hits=1, cache_misses=0)
+                return found[h]
+
+            vector = self.embeddings.embed_query(text)
+            self._store([h], [vector])
+            with self._lock:
+                self.misses += 1
+            s.set(cache_hits=0, cache_misses=1)
+            return vector
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached vectors for this model."""
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)
+            ).fetchone()[0]
+            return {
+                "model": self.model_name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries
+            }
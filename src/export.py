@@ -0,0 +1,92 @@
+"""
+Draft assembly and document export, shared by the Streamlit app and the
+batch runner.
+"""
+from io import BytesIO
+from docx import Document
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+def build_full_draft(sections_dict, section_labels):
+    final = ""
+    for section_label in section_labels:
+        section_text = sections_dict.get(section_label, "").strip()
+        if section_text:
+            final += f"\n\n## {section_label}\n\n{section_text}\n"
+    return final.strip()
+
+def generate_pdf(sections_dict, section_labels, sources):
+    """Generate a PDF from the sections and sources"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    story = []
+    
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        spaceAfter=30,
+        alignment=1 
+    )
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=12,
+        spaceBefore=20
+    )
+    normal_style = styles['Normal']
+    
+    # Add title
+    story.append(Paragraph("Facilities Template", title_style))
+    story.append(Spacer(1, 20))
+    
+    # Add sections
+    for section_label in section_labels:
+        section_text = sections_dict.get(section_label, "").strip()
+        if section_text:
+            story.append(Paragraph(section_label, heading_style))
+            story.append(Paragraph(section_text, normal_style))
+            story.append(Spacer(1, 12))
+    
+
+    if sources:
+        story.append(Paragraph("Sources Used", heading_style))
+        for source in sources:
+            story.append(Paragraph(f"• {source}", normal_style))
+    
+    # Build PDF
+    doc.build(story)
+    buffer.seek(0)
+    return buffer
+
+def generate_word_doc(sections_dict, section_labels, sources):
+    """Generate a Word document from the sections and sources"""
+    doc = Document()
+    
+    # Add sections (no title)
+    for section_label in section_labels:
+        section_text = sections_dict.get(section_label, "").strip()
+        if section_text:
+            # Add section heading
+            doc.add_heading(section_label, level=1)
+            
+            # Add section content
+            doc.add_paragraph(section_text)
+            
+            # Add some spacing
+            doc.add_paragraph()
+    
+    # Add sources if available
+    if sources:
+        doc.add_heading("Sources Used", level=1)
+        for source in sources:
+            doc.add_paragraph(f"• {source}", style='List Bullet')
+    
+    # Save to BytesIO
+    buffer = BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
@@ -1,6 +1,15 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage, SystemMessage
 from src.utils import get_llm, limited_web_search, limited_web_search_specific_sites
-from src.retriever import search_similar_chunks
-from prompt.prompt_template import PROMPT_TEMPLATE
+from src.retriever import search_similar_chunks_batch
+from src.clients import get_config, get_shared_embedding_model
+from src.section_cache import get_section_cache, section_cache_scope
+from src.tracing import span, start_trace, submit_in_context, token_usage, tracing_options
+from src.prompt_builder import build_section_context, count_tokens
+from prompt.prompt_template import SECTION_PROMPT_TEMPLATE, SYSTEM_PROMPT
 
 # Define sections for different funding agencies
 NSF_SECTION_LABELS = [
@@ -24,6 +33,23 @@ NIH_SECTION_LABELS = [
     "7. Equipment"
 ]
 
+INTERNAL_FACILITIES_SITES = [
+    "https://sites.google.com/nyu.edu/nyu-hpc/",
+    "https://www.nyu.edu/life/information-technology/research-computing-services/high-performance-computing.html",
+    "https://www.nyu.edu/life/information-technology/research-computing-services/high-performance-computing/high-performance-computing-nyu-it.html"
+]
+
+# Max in-flight calls per provider, shared by every draft in the process.
+# Override per provider with the `concurrency` block in config.yaml.
+DEFAULT_PROVIDER_CONCURRENCY = {
+    "chroma": 8,
+    "tavily": 4,
+    "llm": 4
+}
+
+_provider_limits = {}
+_provider_limits_lock = threading.Lock()
+
 def get_section_labels_for_agency(selected_types):
     """Get the appropriate section labels based on selected funding agency"""
     if not selected_types:
@@ -34,63 +60,262 @@ def get_section_labels_for_agency(selected_types):
     else:
         return NSF_SECTION_LABELS
 
-def generate_enriched_response(user_inputs, selected_types=None, config_path="src/config.yaml"):
-    llm = get_llm(config_path)
-    section_outputs = {} 
-    sources_used = []
-
-    # Get the appropriate section labels based on selected agency
-    section_labels = get_section_labels_for_agency(selected_types)
-
-    if all(not user_inputs.get(section, "").strip() for section in section_labels):
-        return ({}, [])
-
-    for section in section_labels:
-        user_text = user_inputs.get(section, "").strip()
-        if not user_text:
-            continue
-
-        query = f"{section}: {user_text}"
+def _provider_limit(provider, config_path):
+    """Return the process-wide semaphore bounding concurrent calls to `provider`."""
+    key = (config_path, provider)
+    with _provider_limits_lock:
+        if key not in _provider_limits:
+            limits = get_config(config_path).get("concurrency", {})
+            limit = limits.get(provider, DEFAULT_PROVIDER_CONCURRENCY[provider])
+            _provider_limits[key] = threading.BoundedSemaphore(limit)
+        return _provider_limits[key]
 
-        retrieved = search_similar_chunks(query, k=5, selected_types=selected_types, config_path=config_path)
-        retrieved_chunks = [
-            f"{doc.page_content}\n(Source: {doc.metadata.get('source', 'unknown')})"
-            for doc in retrieved
-        ]
-        retrieved_texts_with_sources = "\n\n".join(retrieved_chunks)
-        source_refs = [doc.metadata.get("source", "unknown") for doc in retrieved]
+def _retrieve_draft_chunks(sections, selected_types, config_path):
+    """
+    Retrieval stage for a whole draft: {section: (docs, chunk IDs)}, with all
+    section queries embedded and searched in one batched call.
+    """
+    queries = [f"{section}: {user_text}" for section, user_text in sections]
+    with _provider_limit("chroma", config_path):
+        results = search_similar_chunks_batch(queries, k=5, selected_types=selected_types, config_path=config_path)
+    return {section: result for (section, _), result in zip(sections, results)}
 
+def _search_section_web(section, query, config_path):
+    """Web search stage: (snippets, links) for one section query."""
+    with _provider_limit("tavily", config_path), span("web_search") as s:
         if section == "5a. Internal Facilities (NYU)":
             web_content, web_links = limited_web_search_specific_sites(
                 query,
-                allowed_sites=[
-                    "https://sites.google.com/nyu.edu/nyu-hpc/",
-                    "https://www.nyu.edu/life/information-technology/research-computing-services/high-performance-computing.html",
-                    "https://www.nyu.edu/life/information-technology/research-computing-services/high-performance-computing/high-performance-computing-nyu-it.html"
-                ],
+                allowed_sites=INTERNAL_FACILITIES_SITES,
                 config_path=config_path
             )
         else:
             web_content, web_links = limited_web_search(query, config_path=config_path)
+        s.set(results=len(web_links))
+        return web_content, web_links
+
+def _format_section_prompt(section, user_text, retrieved, web_content, config_path):
+    """
+    Prompt build stage: returns (messages, source_refs); the context report is
+    attached to the prompt_build span. The static
+    SYSTEM_PROMPT comes first so every section shares a cacheable prefix.
+    """
+    source_refs = [doc.metadata.get("source", "unknown") for doc in retrieved]
+    chunks = [(doc.page_content, doc.metadata.get("source", "unknown")) for doc in retrieved]
 
-        prompt = PROMPT_TEMPLATE.format(
+    with span("prompt_build") as s:
+        retrieved_texts_with_sources, web_snippets, report = build_section_context(
+            f"{section}: {user_text}", chunks, web_content, get_config(config_path).get("prompt", {})
+        )
+        section_prompt = SECTION_PROMPT_TEMPLATE.format(
             section=section,
             user_input=user_text,
             retrieved_chunks=retrieved_texts_with_sources,
-            web_snippets=web_content
+            web_snippets=web_snippets
+        )
+        messages = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=section_prompt)]
+        report["prompt_tokens"] = count_tokens(SYSTEM_PROMPT) + count_tokens(section_prompt)
+        s.set(prompt_chars=len(SYSTEM_PROMPT) + len(section_prompt), **report)
+    return messages, source_refs
+
+def _section_context(section, user_text, retrieval, config_path):
+    """Web search for one section, joined with its retrieval: (retrieved, chunk_ids, web_content, web_links)."""
+    retrieved, chunk_ids = retrieval
+    web_content, web_links = _search_section_web(section, f"{section}: {user_text}", config_path)
+    return retrieved, chunk_ids, web_content, web_links
+
+def _lookup_cached_section(llm, section, user_text, selected_types, retrieved, chunk_ids, web_content, config_path, use_cache):
+    """
+    Section cache stage: returns (entry, cached). `cached` is a previously
+    generated (response_text, sources) or None; pass `entry` to
+    `_store_cached_section` after generating. Both are None when the
+    section cache is disabled. With `use_cache` False the lookup is skipped
+    but `entry` is still returned, so the regenerated section replaces it.
+    """
+    config = get_config(config_path)
+    cache = get_section_cache(config)
+    if cache is None:
+        return None, None
+
+    with span("section_cache") as s:
+        scope = section_cache_scope(
+            selected_types,
+            section,
+            chunk_ids,
+            [doc.page_content for doc in retrieved],
+            web_content,
+            getattr(llm, "model_name", type(llm).__name__),
+            [SYSTEM_PROMPT, SECTION_PROMPT_TEMPLATE, config.get("prompt", {})]
+        )
+        if not use_cache:
+            s.set(hit=False, bypassed=True)
+            return (cache, scope, None), None
+        embedding = None
+        if cache.similarity_threshold is not None:
+            # same text as the retrieval query, so a cached embedding is reused
+            embedding = get_shared_embedding_model(config_path).embed_query(f"{section}: {user_text}")
+        cached = cache.get(scope, user_text, embedding)
+        s.set(hit=cached is not None)
+    return (cache, scope, embedding), cached
+
+def _store_cached_section(entry, user_text, response_text, sources):
+    if entry is not None:
+        cache, scope, embedding = entry
+        cache.put(scope, user_text, response_text, sources, embedding)
+
+def _cited_sources(response_text, source_refs, web_links):
+    """Return the PDF sources and web links actually cited in `response_text`."""
+    cited_sources = [src for src in source_refs if f"(Source: {src})" in response_text]
+    cited_web_links = [
+        link for link in web_links if f"(Web Source: {link})" in response_text
+    ]
+    return cited_sources + cited_web_links
+
+def _generate_section(llm, section, user_text, selected_types, retrieval, config_path, use_cache):
+    with span("section", section=section):
+        retrieved, chunk_ids, web_content, web_links = _section_context(section, user_text, retrieval, config_path)
+        entry, cached = _lookup_cached_section(
+            llm, section, user_text, selected_types, retrieved, chunk_ids, web_content, config_path, use_cache
         )
+        if cached is not None:
+            return cached
 
-        result = llm.invoke(prompt)
+        messages, source_refs = _format_section_prompt(section, user_text, retrieved, web_content, config_path)
+        with _provider_limit("llm", config_path), span("llm") as s:
+            result = llm.invoke(messages)
+            s.set(**token_usage(result))
         response_text = result.content.strip()
+        sources = _cited_sources(response_text, source_refs, web_links)
+
+        _store_cached_section(entry, user_text, response_text, sources)
+        return response_text, sources
+
+def _sections_to_generate(user_inputs, selected_types):
+    """Return (section, user_text) pairs for the non-empty sections, in label order."""
+    section_labels = get_section_labels_for_agency(selected_types)
+    return [
+        (section, user_inputs.get(section, "").strip())
+        for section in section_labels
+        if user_inputs.get(section, "").strip()
+    ]
 
-        section_outputs[section] = response_text
+def generate_enriched_response(user_inputs, selected_types=None, config_path="src/config.yaml", use_cache=True):
+    """
+    Draft every non-empty section concurrently.
+    Retrieval for all sections is one batched embedding call and one vector
+    query; each section then runs web search and the LLM call on its own worker,
+    bounded by the per-provider limits in the `concurrency` config block, so the
+    draft takes about as long as its slowest section. Sections whose inputs and
+    context are unchanged are served from the section cache without an LLM call,
+    unless `use_cache` is False (regenerate), which also refreshes the cache.
+    """
+    sections = _sections_to_generate(user_inputs, selected_types)
+    if not sections:
+        return ({}, [])
 
-        cited_sources = [src for src in source_refs if f"(Source: {src})" in response_text]
-        sources_used.extend(cited_sources)
+    enabled, export_path = tracing_options(get_config(config_path))
+    with start_trace("generate_enriched_response", enabled=enabled, export_path=export_path, sections=len(sections)):
+        llm = get_llm(config_path)
+        retrievals = _retrieve_draft_chunks(sections, selected_types, config_path)
+        section_outputs = {}
+        sources_used = []
 
-        cited_web_links = [
-            link for link in web_links if f"(Web Source: {link})" in response_text
-        ]
-        sources_used.extend(cited_web_links)
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [
+                (section, submit_in_context(
+                    executor, _generate_section, llm, section, user_text, selected_types, retrievals[section], config_path,
+                    use_cache
+                ))
+                for section, user_text in sections
+            ]
+            for section, future in futures:
+                response_text, cited = future.result()
+                section_outputs[section] = response_text
+                sources_used.extend(cited)
 
     return section_outputs, list(set(sources_used))
+
+def _stream_section(llm, section, user_text, selected_types, retrieval, config_path, use_cache, events):
+    """Stream one section's LLM output into `events`, tagged with the section."""
+    try:
+        with span("section", section=section):
+            retrieved, chunk_ids, web_content, web_links = _section_context(section, user_text, retrieval, config_path)
+            entry, cached = _lookup_cached_section(
+                llm, section, user_text, selected_types, retrieved, chunk_ids, web_content, config_path, use_cache
+            )
+            if cached is not None:
+                response_text, sources = cached
+                events.put({"type": "delta", "section": section, "text": response_text})
+                events.put({"type": "section_done", "section": section, "text": response_text, "sources": sources})
+                return
+
+            messages, source_refs = _format_section_prompt(section, user_text, retrieved, web_content, config_path)
+            parts = []
+            message = None
+            with _provider_limit("llm", config_path), span("llm", streaming=True) as s:
+                start = time.perf_counter()
+                # OpenAI only reports usage (with cached tokens, langchain-openai >= 0.2.2) on a stream when asked
+                for chunk in llm.stream(messages, stream_usage=True):
+                    message = chunk if message is None else message + chunk
+                    if chunk.content:
+                        if not parts:
+                            s.set(first_token_ms=round((time.perf_counter() - start) * 1000, 3))
+                        parts.append(chunk.content)
+                        events.put({"type": "delta", "section": section, "text": chunk.content})
+                s.set(chunks=len(parts), **token_usage(message))
+            response_text = "".join(parts).strip()
+            sources = _cited_sources(response_text, source_refs, web_links)
+            _store_cached_section(entry, user_text, response_text, sources)
+
+        events.put({
+            "type": "section_done",
+            "section": section,
+            "text": response_text,
+            "sources": sources
+        })
+    except Exception as e:
+        events.put({"type": "error", "section": section, "error": e})
+
+def stream_enriched_response(user_inputs, selected_types=None, config_path="src/config.yaml", use_cache=True):
+    """
+    Streaming variant of `generate_enriched_response`.
+
+    Sections are generated concurrently and events are yielded as they arrive:
+      {"type": "delta", "section", "text"}           one token delta
+      {"type": "section_done", "section", "text", "sources"}
+      {"type": "done", "section_outputs", "sources_used"}  always last
+    The final event carries the same values the batch API returns. To trace
+    a streamed draft, wrap the iteration in `start_trace(...)`.
+    """
+    sections = _sections_to_generate(user_inputs, selected_types)
+    if not sections:
+        yield {"type": "done", "section_outputs": {}, "sources_used": []}
+        return
+
+    llm = get_llm(config_path)
+    retrievals = _retrieve_draft_chunks(sections, selected_types, config_path)
+    events = queue.Queue()
+    finished = {}
+
+    with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+        for section, user_text in sections:
+            submit_in_context(
+                executor, _stream_section, llm, section, user_text, selected_types, retrievals[section], config_path,
+                use_cache, events
+            )
+
+        while len(finished) < len(sections):
+            event = events.get()
+            if event["type"] == "error":
+                raise event["error"]
+            if event["type"] == "section_done":
+                finished[event["section"]] = event
+            yield event
+
+    section_outputs = {}
+    sources_used = []
+    for section, _ in sections:
+        section_outputs[section] = finished[section]["text"]
+        sources_used.extend(finished[section]["sources"])
+
+    yield {"type": "done", "section_outputs": section_outputs, "sources_used": list(set(sources_used))}
@@ -0,0 +1,278 @@
+"""
+Background jobs for drafting and ingestion.
+
+Jobs are rows in a local SQLite queue; a pool of worker threads claims them
+in submission order, runs the handler for the job's kind and persists its
+progress and result. Callers (the Streamlit app) submit a job, keep its id
+and poll `get(job_id)`, so work survives script reruns and page reloads and
+every session shares the same worker capacity.
+
+Handlers take (params, report) and return a JSON-serializable result;
+`report(progress, message, result=None)` updates the job while it runs.
+Each process refreshes a heartbeat on the jobs it is running, so a job
+still marked running with a heartbeat older than `stale_seconds` was lost
+to a process restart and is claimed again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from src.clients import get_config
+from src.generate import stream_enriched_response
+from src.pdf_ingest import ingest_pdfs
+from src.tracing import start_trace, tracing_options
+
+DEFAULT_JOBS_CONFIG = {
+    "path": "jobs.sqlite3",
+    "workers": 2,
+    "stale_seconds": 600,
+    "max_age_seconds": 7 * 24 * 3600
+}
+
+# Minimum seconds between partial-draft writes while a section is streaming
+_DRAFT_REPORT_INTERVAL = 0.5
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+# One ingest at a time per Chroma store: each run owns the manifest, writer and derived indexes
+_ingest_locks = {}
+_ingest_locks_lock = threading.Lock()
+
+
+def _run_draft(params, report):
+    """Stream a draft, persisting finished and in-progress sections as it goes."""
+    config_path = params.get("config_path", "src/config.yaml")
+    total = sum(1 for text in params["user_inputs"].values() if text.strip())
+    sections = {}
+    finished = 0
+    last_report = 0.0
+    enabled, export_path = tracing_options(get_config(config_path))
+    with start_trace("draft", enabled=enabled, export_path=export_path, job=True) as trace:
+        for event in stream_enriched_response(
+            params["user_inputs"],
+            selected_types=params.get("selected_types"),
+            config_path=config_path,
+            use_cache=params.get("use_cache", True)
+        ):
+            if event["type"] == "done":
+                return {
+                    "section_outputs": event["section_outputs"],
+                    "sources_used": event["sources_used"],
+                    "trace": trace.summary() if trace else []
+                }
+            if event["type"] == "delta":
+                sections[event["section"]] = sections.get(event["section"], "") + event["text"]
+            else:
+                sections[event["section"]] = event["text"]
+                finished += 1
+
+            if event["type"] == "section_done" or time.monotonic() - last_report >= _DRAFT_REPORT_INTERVAL:
+                report(
+                    finished / total,
+                    f"{finished} of {total} sections drafted",
+                    {"section_outputs": dict(sections), "sources_used": []}
+                )
+                last_report = time.monotonic()
+
+
+def _ingest_store(params):
+    """Persist directory an ingest job writes to."""
+    config = get_config(params.get("config_path", "src/config.yaml"))
+    return os.path.abspath(config["chroma"]["persist_directory"])
+
+
+def _run_ingest(params, report):
+    def progress(done, total, message):
+        report(done / total if total else 1.0, message)
+
+    with _ingest_locks_lock:
+        lock = _ingest_locks.setdefault(_ingest_store(params), threading.Lock())
+    if not lock.acquire(blocking=False):
+        report(0.0, "Waiting for another ingest of the same store to finish")
+        lock.acquire()
+    try:
+        return ingest_pdfs(
+            data_folder=params.get("data_folder", "data"),
+            config_path=params.get("config_path", "src/config.yaml"),
+            progress=progress
+        )
+    finally:
+        lock.release()
+
+
+JOB_HANDLERS = {
+    "draft": _run_draft,
+    "ingest": _run_ingest
+}
+
+
+class JobQueue:
+    """SQLite-backed job queue drained by a pool of daemon worker threads."""
+
+    def __init__(self, path, workers, stale_seconds, max_age_seconds):
+        self.path = path
+        self.stale_seconds = stale_seconds
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " progress REAL,"
+            " message TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " started REAL,"
+            " finished REAL,"
+            " heartbeat REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        self._conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+            (time.time() - max_age_seconds,)
+        )
+        self._conn.commit()
+
+        self.workers = [
+            threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, kind, params):
+        """
+        Queue a job and return its id. An ingest of a store that already has
+        one queued or running returns that job's id instead.
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._wake:
+            if kind == "ingest":
+                store = _ingest_store(params)
+                # write lock held from the check to the insert, so other processes on this file can't race it
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    active = self._conn.execute(
+                        "SELECT id, params FROM jobs WHERE kind = 'ingest' AND status IN ('queued', 'running') ORDER BY created"
+                    ).fetchall()
+                    active_id = next((i for i, p in active if _ingest_store(json.loads(p)) == store), None)
+                except Exception:
+                    self._conn.rollback()
+                    raise
+                if active_id:
+                    self._conn.commit()
+                    return active_id
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, progress, created) VALUES (?, ?, ?, 'queued', 0, ?)",
+                (job_id, kind, json.dumps(params), time.time())
+            )
+            self._conn.commit()
+            self._wake.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Current state of a job as a dict, or None if unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, params, status, progress, message, result, error, created, started, finished "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ["id", "kind", "params", "status", "progress", "message", "result", "error", "created", "started", "finished"]
+        job = dict(zip(keys, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _report(self, job_id, progress=None, message=None, result=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = COALESCE(?, progress), message = COALESCE(?, message), "
+                "result = COALESCE(?, result), heartbeat = ? WHERE id = ?",
+                (progress, message, json.dumps(result) if result is not None else None, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def _heartbeat(self):
+        """Keep this process's running jobs fresh so they are never taken for stale."""
+        while True:
+            time.sleep(max(1, self.stale_seconds / 4))
+            with self._lock:
+                for job_id in self._running:
+                    self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+                self._conn.commit()
+
+    def _claim(self):
+        """Mark the oldest queued (or stale running) job as running and return it."""
+        claimable = "(status = 'queued' OR (status = 'running' AND heartbeat < ?))"
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id, kind, params FROM jobs WHERE {claimable} ORDER BY created LIMIT 1",
+                (now - self.stale_seconds,)
+            ).fetchone()
+            if row is None:
+                return None
+            # conditional update, so another process polling the same file cannot claim it too
+            claimed = self._conn.execute(
+                f"UPDATE jobs SET status = 'running', started = ?, heartbeat = ? WHERE id = ? AND {claimable}",
+                (now, now, row[0], now - self.stale_seconds)
+            ).rowcount
+            self._conn.commit()
+            if not claimed:
+                return None
+            self._running.add(row[0])
+            return row[0], row[1], json.loads(row[2])
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._wake:
+                    # also re-check periodically for stale jobs and other processes' submissions
+                    self._wake.wait(timeout=5)
+                continue
+
+            job_id, kind, params = job
+            report = lambda progress=None, message=None, result=None: self._report(job_id, progress, message, result)
+            try:
+                result = JOB_HANDLERS[kind](params, report)
+                status, error = "done", None
+            except Exception as e:
+                result, status, error = None, "failed", f"{type(e).__name__}: {e}"
+                print(f"Job {job_id} ({kind}) failed: {error}")
+
+            with self._lock:
+                self._running.discard(job_id)
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, "
+                    "result = COALESCE(?, result), error = ?, finished = ? WHERE id = ?",
+                    (status, status, json.dumps(result, default=str) if result is not None else None, error, time.time(), job_id)
+                )
+                self._conn.commit()
+
+
+def get_job_queue(config_path="src/config.yaml"):
+    """Process-wide queue and workers for the `jobs` block of the config."""
+    jobs_config = {**DEFAULT_JOBS_CONFIG, **get_config(config_path).get("jobs", {})}
+    with _queues_lock:
+        if jobs_config["path"] not in _queues:
+            _queues[jobs_config["path"]] = JobQueue(
+                jobs_config["path"],
+                jobs_config["workers"],
+                jobs_config["stale_seconds"],
+                jobs_config["max_age_seconds"]
+            )
+        return _queues[jobs_config["path"]]
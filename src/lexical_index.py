@@ -0,0 +1,127 @@
+"""
+Local BM25 inverted index over the ingested chunks.
+
+Facilities text is full of exact tokens (instrument model numbers, cluster
+names such as "Greene" or "COSMOS", GPU counts) that dense retrieval ranks
+poorly. This index keeps every chunk in an SQLite FTS5 table keyed by the
+same chunk IDs as the Chroma collection; `ingest_pdfs` upserts and deletes
+it alongside Chroma, so the two stay in sync incrementally. Searching it
+needs no embedding call.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from src.utils import agency_for_folder
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+# Rows per page when backfilling from an existing Chroma collection
+_BACKFILL_BATCH = 1000
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _match_expression(query):
+    """FTS5 query matching any term of `query`, each quoted so no term is read as syntax."""
+    terms = dict.fromkeys(term.lower() for term in _TERM.findall(query))
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def _agency(metadata):
+    return metadata.get("agency") or agency_for_folder(metadata.get("folder", ""))
+
+
+class LexicalIndex:
+    """FTS5 table of (chunk_id, agency, metadata, text) ranked with bm25()."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            " chunk_id UNINDEXED, agency UNINDEXED, metadata UNINDEXED, text)"
+        )
+        self._conn.commit()
+
+    def upsert(self, ids, texts, metadatas):
+        rows = [
+            (chunk_id, _agency(metadata or {}), json.dumps(metadata or {}), text)
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        with self._lock:
+            self._delete(ids)
+            self._conn.executemany(
+                "INSERT INTO chunks (chunk_id, agency, metadata, text) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def _delete(self, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            self._conn.execute(
+                f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+            )
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query, k, agencies=None):
+        """Top `k` chunks by BM25 as [(chunk_id, text, metadata)], best first."""
+        expression = _match_expression(query)
+        if not expression:
+            return []
+        sql = "SELECT chunk_id, text, metadata FROM chunks WHERE chunks MATCH ?"
+        params = [expression]
+        if agencies:
+            sql += f" AND agency IN ({','.join('?' * len(agencies))})"
+            params.extend(agency.upper() for agency in agencies)
+        sql += " ORDER BY bm25(chunks) LIMIT ?"
+        params.append(k)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(chunk_id, text, json.loads(metadata)) for chunk_id, text, metadata in rows]
+
+    def backfill(self, collection):
+        """Index every chunk already in a Chroma `collection`; returns the number indexed."""
+        total = collection.count()
+        for offset in range(0, total, _BACKFILL_BATCH):
+            page = collection.get(limit=_BACKFILL_BATCH, offset=offset, include=["documents", "metadatas"])
+            self.upsert(page["ids"], page["documents"], page["metadatas"])
+        return total
+
+
+def lexical_index_path(config):
+    persist_dir = config["chroma"]["persist_directory"]
+    return config.get("retrieval", {}).get("lexical_index_path", os.path.join(persist_dir, "lexical_index.sqlite3"))
+
+
+def get_lexical_index(config, create=True):
+    """
+    Shared index for the Chroma store in `config`. Readers pass
+    `create=False` so searching never adds a file next to the store; the
+    index is built by ingest.
+    """
+    path = lexical_index_path(config)
+    with _indexes_lock:
+        if path not in _indexes:
+            if not create and not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"No lexical index at {path}. Reindex the PDFs to build it, "
+                    "or set retrieval.mode to vector."
+                )
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            _indexes[path] = LexicalIndex(path)
+        return _indexes[path]
@@ -0,0 +1,194 @@
+"""
+Deterministic local stand-ins for the hosted backends.
+
+Selected through the `backends` block in config.yaml (see
+src/config.local.yaml), they let ingestion, retrieval, generation and the
+drift scripts run end to end without network access or spend:
+
+  embeddings: "hashing"  -> HashingEmbeddings (feature-hashed bag of words)
+  llm:        "fake"     -> FakeChatModel (canned latency, echoes the input,
+                            reports token usage with simulated prefix caching)
+  web_search: "fixture"  -> FixtureSearchClient (results from a JSON file)
+
+Outputs depend only on their inputs, so timings and results are reproducible.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+from urllib.parse import urlparse
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from src.prompt_builder import count_tokens
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+
+
+def _tokens(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class HashingEmbeddings(Embeddings):
+    """Unit-length feature-hashed word and bigram counts; no model, no network."""
+
+    def __init__(self, dimensions=1536):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        tokens = _tokens(text)
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _fake_draft(messages):
+    """
+    Build a plausible section from the last (user) message: the user input followed by one
+    citation of the first PDF chunk and first web snippet it was given.
+    """
+    prompt = messages[-1].content if messages else ""
+    user_input = re.search(r'\*\*User Input:\*\*\s*"""\s*(.*?)\s*"""', prompt, re.S)
+    draft = user_input.group(1).strip() if user_input else prompt[-200:].strip()
+
+    # only cite sources that appear after the user input, not the few-shot examples
+    context = prompt[user_input.end():] if user_input else prompt
+    pdf_source = re.search(r"\(Source: ([^)]+)\)", context)
+    web_source = re.search(r"\(Web Source: ([^\n]+)\)[ \t]*$", context, re.M)
+    if pdf_source:
+        draft += f" These resources are described in prior proposals (Source: {pdf_source.group(1)})."
+    if web_source:
+        draft += f" Further details are available online (Web Source: {web_source.group(1)})."
+    return draft
+
+
+_seen_prefixes = set()
+_seen_prefixes_lock = threading.Lock()
+
+# OpenAI caches prefixes of at least 1024 tokens, in 128-token increments
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+
+
+def _cached_prefix_tokens(prefix):
+    tokens = count_tokens(prefix)
+    if tokens < PROMPT_CACHE_MIN_TOKENS:
+        return 0
+    return tokens - (tokens - PROMPT_CACHE_MIN_TOKENS) % PROMPT_CACHE_INCREMENT
+
+
+def _fake_usage(messages, text):
+    """
+    OpenAI-style token usage. Leading system messages count as cached once
+    the same prefix has been sent before, like a provider prompt cache, and
+    only when the prefix is long enough for the provider to cache it.
+    """
+    prefix = ""
+    for message in messages:
+        if not isinstance(message, SystemMessage):
+            break
+        prefix += message.content
+    with _seen_prefixes_lock:
+        cached = prefix in _seen_prefixes
+        _seen_prefixes.add(prefix)
+    return {
+        "prompt_tokens": sum(count_tokens(m.content) for m in messages),
+        "completion_tokens": count_tokens(text),
+        "prompt_tokens_details": {"cached_tokens": _cached_prefix_tokens(prefix) if cached else 0}
+    }
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with canned latency: `first_token_latency` then `token_latency` per token."""
+
+    model_name: str = "local-fake-chat"
+    first_token_latency: float = 0.5
+    token_latency: float = 0.01
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fake-chat"
+
+    def _split(self, text):
+        return re.findall(r"\S+\s*", text)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = _fake_draft(messages)
+        time.sleep(self.first_token_latency + self.token_latency * len(self._split(text)))
+        message = AIMessage(content=text, response_metadata={"token_usage": _fake_usage(messages, text)})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        text = _fake_draft(messages)
+        time.sleep(self.first_token_latency)
+        for token in self._split(text):
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        # like ChatOpenAI, usage arrives on a final empty chunk and only when stream_usage is set
+        if kwargs.get("stream_usage"):
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", response_metadata={"token_usage": _fake_usage(messages, text)}
+            ))
+
+
+class FixtureSearchClient:
+    """
+    Drop-in for `TavilyClient.search` serving results from a JSON fixture
+    ({"results": [{"url", "content"}, ...]}). A "site:<site> <query>" search
+    returns the fixture entries under that site, ranked by word overlap.
+    """
+
+    def __init__(self, fixture_path, latency_seconds=0.0):
+        with open(fixture_path, "r") as f:
+            self.results = json.load(f)["results"]
+        self.latency_seconds = latency_seconds
+
+    def _in_site(self, url, site):
+        if "://" in site:
+            return url.startswith(site)
+        netloc = urlparse(url).netloc
+        return netloc == site or netloc.endswith(f".{site}")
+
+    def search(self, query, search_depth="basic", max_results=5, **kwargs):
+        time.sleep(self.latency_seconds)
+        site = None
+        if query.startswith("site:"):
+            site, _, query = query[len("site:"):].partition(" ")
+
+        query_tokens = set(_tokens(query))
+        candidates = [r for r in self.results if site is None or self._in_site(r["url"], site)]
+        ranked = sorted(
+            candidates,
+            key=lambda r: (-len(query_tokens & set(_tokens(r["content"]))), r["url"])
+        )
+        return {"query": query, "results": ranked[:max_results]}
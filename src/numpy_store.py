@@ -0,0 +1,255 @@
+"""
+Exact in-process vector search over a NumPy export of the Chroma collection.
+
+For small corpora (the NSF store is a few hundred chunks) one matrix product
+over every stored vector is faster than an HNSW lookup behind a persistent
+Chroma client, and it is exact. `export_numpy_store` writes the collection
+to a directory holding
+
+  vectors.npy   float32 matrix, one row per chunk, opened memory-mapped
+  chunks.json   ids, documents, metadatas and the collection's distance space
+
+and `NumpyStore` answers top-k queries from it with agency masks, using the
+same distance as the collection (Chroma's default l2, or cosine / ip).
+Select it with `retrieval.backend: numpy`; `ingest_pdfs` re-exports after
+every change so the snapshot never lags the collection.
+
+With `retrieval.numpy_store_dtype: float16` or `int8` the export also holds
+a scalar-quantized copy of the vectors (`vectors.float16.npy`, or
+`vectors.int8.npy` plus per-row `scales.npy`). Only that copy is loaded
+into memory and scanned; the float32 matrix stays memory-mapped and is
+read just for the top `retrieval.rescore_candidates` rows of each query,
+which are re-ranked exactly. Row norms are stored in `norms.npy` so
+opening a store never touches the float32 pages.
+
+Each export stamps its array files with a fresh version (`vectors.<version>.npy`)
+and names that version in `chunks.json`, which is replaced last. A reader
+therefore loads either the old export or the new one, never a mix; files of
+earlier versions are removed once the new `chunks.json` is in place.
+"""
+import json
+import os
+import threading
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from src.utils import agency_for_folder
+
+# Rows per page when reading the collection
+_EXPORT_BATCH = 1000
+
+# Quantized rows widened to float32 at a time during the first pass; small
+# enough that the float32 block stays in cache
+_SCAN_BLOCK = 256
+
+DTYPES = ("float32", "float16", "int8")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def numpy_store_path(config):
+    persist_dir = config["chroma"]["persist_directory"]
+    return config.get("retrieval", {}).get("numpy_store_path", os.path.join(persist_dir, "numpy_store"))
+
+
+def numpy_store_dtype(config):
+    return config.get("retrieval", {}).get("numpy_store_dtype", "float32")
+
+
+def export_numpy_store(collection, output_dir, dtype="float32"):
+    """Write every chunk of a Chroma `collection` to `output_dir`; returns the chunk count."""
+    ids, documents, metadatas, vectors = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, _EXPORT_BATCH):
+        page = collection.get(
+            limit=_EXPORT_BATCH,
+            offset=offset,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(m or {} for m in page["metadatas"])
+        vectors.extend(page["embeddings"])
+
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    write_numpy_store(output_dir, ids, documents, metadatas, vectors, space, dtype)
+    return len(ids)
+
+
+def quantize(matrix, dtype):
+    """Scalar-quantize float32 rows as (codes, per-row scales or None)."""
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown NumPy store dtype: {dtype}")
+
+
+def _array_file(name, version):
+    return f"{name}.{version}.npy" if version else f"{name}.npy"
+
+
+def _store_files(path, chunks):
+    version, dtype = chunks.get("version"), chunks.get("dtype", "float32")
+    names = ["vectors", "norms"] + ([f"vectors.{dtype}"] if dtype != "float32" else []) + (["scales"] if dtype == "int8" else [])
+    return {name: os.path.join(path, _array_file(name, version)) for name in names}
+
+
+def numpy_store_files(path):
+    """{array name: file path} for the export `path`/chunks.json currently names."""
+    with open(os.path.join(path, "chunks.json"), "r") as f:
+        return _store_files(path, json.load(f))
+
+
+def write_numpy_store(output_dir, ids, documents, metadatas, vectors, space="l2", dtype="float32"):
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown NumPy store dtype: {dtype}")
+    os.makedirs(output_dir, exist_ok=True)
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+
+    arrays = {"vectors": matrix, "norms": np.linalg.norm(matrix, axis=1).astype(np.float32)}
+    if dtype != "float32":
+        arrays[f"vectors.{dtype}"], scales = quantize(matrix, dtype)
+        if scales is not None:
+            arrays["scales"] = scales
+
+    # new arrays go to version-stamped names; replacing chunks.json switches readers over in one step
+    version = uuid.uuid4().hex[:12]
+    keep = {"chunks.json"}
+    for name, array in arrays.items():
+        keep.add(_array_file(name, version))
+        np.save(os.path.join(output_dir, _array_file(name, version)), array)
+    tmp_path = os.path.join(output_dir, f"chunks.{version}.tmp.json")
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "version": version, "space": space, "dtype": dtype,
+            "ids": ids, "documents": documents, "metadatas": metadatas
+        }, f)
+    os.replace(tmp_path, os.path.join(output_dir, "chunks.json"))
+
+    # readers holding an older version keep their open memmaps after the unlink
+    for name in os.listdir(output_dir):
+        if name.endswith(".npy") and name.split(".")[0] in ("vectors", "norms", "scales") and name not in keep:
+            os.remove(os.path.join(output_dir, name))
+
+
+class NumpyStore:
+    """Memory-mapped vectors plus chunk metadata, searched exactly with NumPy."""
+
+    def __init__(self, path, rescore_candidates=40):
+        self.path = path
+        self.rescore_candidates = rescore_candidates
+        with open(os.path.join(path, "chunks.json"), "r") as f:
+            chunks = json.load(f)
+        self.space = chunks["space"]
+        self.dtype = chunks.get("dtype", "float32")
+        self.ids = chunks["ids"]
+        self.documents = chunks["documents"]
+        self.metadatas = chunks["metadatas"]
+        files = _store_files(path, chunks)
+        # stores exported before the `agency` field existed fall back to the folder
+        self.agencies = np.asarray([m.get("agency") or agency_for_folder(m.get("folder", "")) for m in self.metadatas])
+        self.vectors = np.load(files["vectors"], mmap_mode="r")
+        if self.vectors.shape[0] != len(self.ids):
+            raise ValueError(f"NumPy store at {path} is inconsistent; re-export it")
+        self._row_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+
+        # first-pass matrix: the float32 memmap itself, or the quantized copy held in memory
+        self._codes, self._scales = self.vectors, None
+        if self.dtype != "float32":
+            self._codes = np.load(files[f"vectors.{self.dtype}"])
+            if self.dtype == "int8":
+                self._scales = np.load(files["scales"])
+
+        norms = np.load(files["norms"]) if os.path.exists(files["norms"]) else np.linalg.norm(self.vectors, axis=1)
+        self._sq_norms = norms ** 2
+        self._inv_norms = 1.0 / np.where(norms == 0, 1, norms)
+
+    def memory_bytes(self):
+        """Bytes held in memory for the first pass (the float32 rows are only paged in to rescore)."""
+        arrays = [self._codes, self._scales, self._sq_norms, self._inv_norms]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def _first_pass_dots(self, queries):
+        if self.dtype == "float32":
+            return queries @ self.vectors.T
+        # widen a block of codes at a time; BLAS has no float16 / int8 kernels
+        dots = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        buffer = np.empty((_SCAN_BLOCK, self._codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.ids), _SCAN_BLOCK):
+            codes = self._codes[start:start + _SCAN_BLOCK]
+            block = buffer[:len(codes)]
+            np.copyto(block, codes, casting="unsafe")
+            dots[:, start:start + len(codes)] = queries @ block.T
+        if self._scales is not None:
+            dots *= self._scales[None, :]
+        return dots
+
+    def _distances(self, dots, rows=slice(None)):
+        """Distances from query-row dot products; smaller is closer, ordered as Chroma orders them."""
+        if self.space == "l2":
+            return self._sq_norms[rows] - 2.0 * dots
+        if self.space == "cosine":
+            return -dots * self._inv_norms[rows]
+        return -dots
+
+    def _top(self, distances, k):
+        """Rows of the `k` smallest finite distances, closest first."""
+        k = min(k, len(distances))
+        if not k:
+            return np.zeros(0, dtype=int)
+        candidates = np.argpartition(distances, k - 1)[:k]
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        return candidates[np.isfinite(distances[candidates])]
+
+    def search(self, query_embeddings, k, agencies=None, include_vectors=False):
+        """Top-k per query as [(docs, ids, vectors or None)], closest first."""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        distances = self._distances(self._first_pass_dots(queries))
+        if agencies:
+            distances[:, ~np.isin(self.agencies, [a.upper() for a in agencies])] = np.inf
+
+        results = []
+        for query, row in zip(queries, distances):
+            if self.dtype == "float32":
+                rows = self._top(row, k)
+            else:
+                # re-rank the quantized shortlist with the float32 rows
+                shortlist = np.sort(self._top(row, max(k, self.rescore_candidates)))
+                exact = self._distances(np.asarray(self.vectors[shortlist]) @ query, shortlist)
+                rows = shortlist[self._top(exact, k)]
+            rows = [int(i) for i in rows]
+            docs = [Document(page_content=self.documents[i], metadata=self.metadatas[i]) for i in rows]
+            vectors = np.asarray(self.vectors[rows], dtype=np.float32) if include_vectors else None
+            results.append((docs, [self.ids[i] for i in rows], vectors))
+        return results
+
+    def get_vectors(self, ids):
+        return np.asarray(self.vectors[[self._row_by_id[i] for i in ids]], dtype=np.float32)
+
+
+def get_numpy_store(config):
+    """Shared store for `config`, reloaded whenever the export on disk changes."""
+    path = numpy_store_path(config)
+    rescore_candidates = config.get("retrieval", {}).get("rescore_candidates", 40)
+    marker = os.path.join(path, "chunks.json")
+    if not os.path.exists(marker):
+        raise FileNotFoundError(
+            f"No NumPy vector store at {path}; run `python export_numpy_store.py` or ingest_pdfs first"
+        )
+    version = (os.path.getmtime(marker), rescore_candidates)
+    with _stores_lock:
+        cached = _stores.get(path)
+        if cached is None or cached[0] != version:
+            try:
+                store = NumpyStore(path, rescore_candidates)
+            except FileNotFoundError:
+                # an export finished between reading chunks.json and its arrays; load the new one
+                version = (os.path.getmtime(marker), rescore_candidates)
+                store = NumpyStore(path, rescore_candidates)
+            _stores[path] = (version, store)
+        return _stores[path][1]
@@ -1,95 +1,452 @@
+import contextvars
+import hashlib
+import json
+import multiprocessing
 import os
+import queue
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
-from src.utils import get_embedding_model, read_yaml_as_dict
+from src.utils import agency_for_folder, get_embedding_model, read_yaml_as_dict
+from src.clients import invalidate_clients
+from src.lexical_index import get_lexical_index
+from src.numpy_store import export_numpy_store, numpy_store_dtype, numpy_store_path
+from src.rate_limit import RateLimiter, is_rate_limit_error, retry_after_seconds
+from src.tracing import record_span, span, start_trace, submit_in_context, tracing_options
 
-def ingest_pdfs(data_folder="data", config_path="src/config.yaml"):
-    config = read_yaml_as_dict(config_path)
-    persist_dir = config["chroma"]["persist_directory"]
-    embedding = get_embedding_model(config_path)
-    all_chunks = []
+# Defaults for the `ingest` block in config.yaml
+DEFAULT_INGEST_CONFIG = {
+    "parse_workers": min(4, os.cpu_count() or 1),
+    "embed_workers": 4,
+    "tokens_per_minute": 1_000_000,
+    "batch_tokens": 50_000,
+    "write_batch_size": 5_000,
+    "max_retries": 5
+}
+
+def _estimate_tokens(text):
+    # ~4 characters per token for English prose; only used for budgeting
+    return len(text) // 4 + 1
+
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _chunk_id(relative_path, file_hash, index):
+    """Deterministic chunk ID: the same file content always maps to the same IDs."""
+    return hashlib.sha256(f"{relative_path}\0{file_hash}\0{index}".encode("utf-8")).hexdigest()[:32]
+
+def _manifest_path(config, persist_dir):
+    return config.get("ingest", {}).get("manifest_path", os.path.join(persist_dir, "ingest_manifest.json"))
+
+def _load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def _save_manifest(manifest_path, manifest):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def _bootstrap_manifest(vectordb, data_folder):
+    """
+    Build a manifest for a store ingested before manifests existed, by grouping
+    chunk IDs by folder/source. Files still on disk are fingerprinted as-is.
+    """
+    manifest = {}
+    existing = vectordb.get(include=["metadatas"])
+    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+        metadata = metadata or {}
+        folder = metadata.get("folder", "root")
+        relative_path = metadata.get("path") or (
+            metadata.get("source", "unknown") if folder == "root"
+            else os.path.join(folder, metadata.get("source", "unknown"))
+        )
+        manifest.setdefault(relative_path, {"chunk_ids": []})["chunk_ids"].append(chunk_id)
+
+    for relative_path, entry in manifest.items():
+        file_path = os.path.join(data_folder, relative_path)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            entry.update(size=stat.st_size, mtime=stat.st_mtime, sha256=_file_sha256(file_path))
+    print(f"Built ingest manifest from {len(existing['ids'])} existing chunks ({len(manifest)} files)")
+    return manifest
+
+def backfill_agency(collection, batch_size=500):
+    """
+    Add the normalized `agency` field to every chunk of `collection` that is
+    missing it or has it wrong; returns the number of chunks updated.
+    """
+    existing = collection.get(include=["metadatas"])
+    ids_to_update = []
+    metadatas_to_update = []
+    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+        metadata = dict(metadata or {})
+        agency = agency_for_folder(metadata.get("folder", ""))
+        if metadata.get("agency") != agency:
+            metadata["agency"] = agency
+            ids_to_update.append(chunk_id)
+            metadatas_to_update.append(metadata)
+
+    # Metadata-only updates keep the stored embeddings untouched
+    for start in range(0, len(ids_to_update), batch_size):
+        collection.update(
+            ids=ids_to_update[start:start + batch_size],
+            metadatas=metadatas_to_update[start:start + batch_size]
+        )
+        print(f"  Agency backfill: {min(start + batch_size, len(ids_to_update))}/{len(ids_to_update)} chunks")
+    return len(ids_to_update)
+
+def _load_and_split(file_path, relative_path, file_hash):
+    """Parse one PDF and split it into chunks. Runs in a worker process."""
+    start = time.perf_counter()
     splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    
-    already_processed = set()
+    docs = PyPDFLoader(file_path).load()
+    chunks = splitter.split_documents(docs)
+
+    folder = os.path.dirname(relative_path) if os.path.dirname(relative_path) else "root"
+    for c in chunks:
+        c.metadata["source"] = os.path.basename(relative_path)
+        c.metadata["path"] = relative_path
+        c.metadata["folder"] = folder
+        c.metadata["agency"] = agency_for_folder(folder)
+    ids = [_chunk_id(relative_path, file_hash, i) for i in range(len(chunks))]
+    return chunks, ids, time.perf_counter() - start
+
+def _token_batches(texts, batch_tokens):
+    """Split `texts` into consecutive batches of at most ~`batch_tokens` tokens."""
+    batch, batch_size = [], 0
+    for text in texts:
+        tokens = _estimate_tokens(text)
+        if batch and batch_size + tokens > batch_tokens:
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(text)
+        batch_size += tokens
+    if batch:
+        yield batch
+
+def _embed_batch(embedding, texts, limiter, max_retries):
+    """Embed one batch within the token budget, backing off only on 429 responses."""
+    tokens = sum(_estimate_tokens(t) for t in texts)
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens)
+        try:
+            return embedding.embed_documents(texts)
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            delay = retry_after_seconds(e, attempt)
+            print(f"  Rate limit hit, pausing embedding for {delay:.1f}s (attempt {attempt + 1} of {max_retries + 1})")
+            limiter.pause(delay)
+
+def _embed_chunks(embedding, chunks, limiter, ingest_config, relative_path):
+    with span("ingest.embed", file=relative_path, chunks=len(chunks)) as s:
+        vectors = []
+        batches = list(_token_batches([c.page_content for c in chunks], ingest_config["batch_tokens"]))
+        for batch in batches:
+            vectors.extend(_embed_batch(embedding, batch, limiter, ingest_config["max_retries"]))
+        s.set(batches=len(batches), estimated_tokens=sum(_estimate_tokens(c.page_content) for c in chunks))
+        return vectors
+
+def _max_batch_size(vectordb):
+    client = vectordb._client
+    if hasattr(client, "get_max_batch_size"):
+        return client.get_max_batch_size()
+    return getattr(client, "max_batch_size", 5000)
+
+def _flush_upserts(vectordb, lexical, buffer, manifest, written, failed):
+    """Write every buffered file to Chroma in as few upsert calls as possible."""
+    if not buffer:
+        return
+    with span("ingest.write", files=len(buffer)) as s:
+        _write_buffer(vectordb, lexical, buffer, manifest, written, failed)
+        s.set(chunks=sum(len(item[3]) for item in buffer))
+    buffer.clear()
+
+def _write_buffer(vectordb, lexical, buffer, manifest, written, failed):
+    ids, vectors, documents, metadatas = [], [], [], []
+    for _, _, chunks, chunk_ids, chunk_vectors, _ in buffer:
+        ids.extend(chunk_ids)
+        vectors.extend(chunk_vectors)
+        documents.extend(c.page_content for c in chunks)
+        metadatas.extend(c.metadata for c in chunks)
+
     try:
-        existing_db = Chroma(persist_directory=persist_dir, embedding_function=embedding)
-        # get all documents from existing database
-        existing_docs = existing_db.get()
-        if existing_docs and existing_docs['metadatas']:
-            for metadata in existing_docs['metadatas']:
-                if metadata and 'source' in metadata:
-                    already_processed.add(metadata['source'])
-        print(f"Found {len(already_processed)} already processed files")
+        step = _max_batch_size(vectordb)
+        for start in range(0, len(ids), step):
+            vectordb._collection.upsert(
+                ids=ids[start:start + step],
+                embeddings=vectors[start:start + step],
+                documents=documents[start:start + step],
+                metadatas=metadatas[start:start + step]
+            )
+        lexical.upsert(ids, documents, metadatas)
+
+        # a modified file's previous chunks are dropped once its new ones are in
+        stale_ids = []
+        for _, relative_path, _, chunk_ids, _, _ in buffer:
+            stale_ids.extend(set(manifest.get(relative_path, {}).get("chunk_ids", [])) - set(chunk_ids))
+        if stale_ids:
+            vectordb._collection.delete(ids=stale_ids)
+            lexical.delete(stale_ids)
     except Exception as e:
-        print(f"No existing database found or error loading it: {e}")
+        for _, relative_path, *_ in buffer:
+            failed.append(relative_path)
+        print(f"Error writing {len(buffer)} files to Chroma: {e}")
+        return
+
+    for _, relative_path, chunks, chunk_ids, _, fingerprint in buffer:
+        manifest[relative_path] = {**fingerprint, "chunk_ids": chunk_ids}
+        written.append((relative_path, len(chunks)))
+        print(f"Successfully processed {relative_path} ({len(chunks)} chunks)")
+    print(f"  Wrote {len(ids)} chunks to Chroma in one batch")
+
+def _chroma_writer(vectordb, lexical, writes, manifest, manifest_path, write_batch_size, written, failed):
+    """
+    Single writer over one open collection handle. Applies ("delete",
+    relative_path) items directly and buffers ("upsert", relative_path, chunks,
+    ids, vectors, fingerprint) items into large batched upserts of precomputed
+    embeddings. The lexical index receives the same upserts and deletes. The
+    manifest is saved after each flush, so an interrupted bulk load resumes
+    where it stopped. Chroma >= 0.4 persists on write, so no separate
+    persist() pass is needed.
+    """
+    buffer = []
+    buffered_chunks = 0
+    while True:
+        item = writes.get()
+        if item is None:
+            _flush_upserts(vectordb, lexical, buffer, manifest, written, failed)
+            return
+
+        if item[0] == "delete":
+            relative_path = item[1]
+            old_ids = manifest.get(relative_path, {}).get("chunk_ids", [])
+            try:
+                if old_ids:
+                    vectordb._collection.delete(ids=old_ids)
+                    lexical.delete(old_ids)
+                manifest.pop(relative_path, None)
+                print(f"Removed {relative_path} ({len(old_ids)} chunks)")
+            except Exception as e:
+                failed.append(relative_path)
+                print(f"Error removing {relative_path} from Chroma: {e}")
+            continue
+
+        buffer.append(item)
+        buffered_chunks += len(item[3])
+        if buffered_chunks >= write_batch_size:
+            _flush_upserts(vectordb, lexical, buffer, manifest, written, failed)
+            _save_manifest(manifest_path, manifest)
+            buffered_chunks = 0
+
+def _sync_numpy_store(config, config_path, vectordb, changed):
+    """Re-export the NumPy vector store when it is the configured backend and is stale or missing."""
+    if config.get("retrieval", {}).get("backend", "chroma") != "numpy":
+        return
+    path = numpy_store_path(config)
+    if not changed and os.path.exists(os.path.join(path, "chunks.json")):
+        return
+    if vectordb is None:
+        vectordb = Chroma(persist_directory=config["chroma"]["persist_directory"],
+                          embedding_function=get_embedding_model(config_path))
+    count = export_numpy_store(vectordb._collection, path, numpy_store_dtype(config))
+    print(f"Exported {count} chunks to the NumPy store at {path}")
+
+def ingest_pdfs(data_folder="data", config_path="src/config.yaml", progress=None, allow_remove_all=False):
+    """
+    Incrementally sync the PDFs under `data_folder` into Chroma and the
+    local lexical (BM25) index.
 
+    A manifest of (relative path, size, mtime, sha256, chunk IDs) decides the
+    work: unchanged files are skipped from a stat() alone, modified files are
+    re-chunked and their old chunks replaced, and chunks of deleted files are
+    removed. Chunk IDs are deterministic, so re-runs are idempotent.
+
+    Changed files go through a three-stage pipeline: parsing/splitting in a
+    process pool, embedding in token-budgeted batches on a thread pool, and
+    bulk Chroma writes (`ingest.write_batch_size` chunks per upsert) on a
+    single writer thread holding one collection handle. Embedding throughput
+    is bounded by `ingest.tokens_per_minute`; retries wait only when the
+    provider actually returns 429.
+
+    `progress(done_files, total_files, message)`, if given, is called as
+    files finish. Returns a summary of what changed.
+
+    A missing `data_folder` raises FileNotFoundError. A folder with no PDFs
+    would remove every indexed file, so that raises ValueError unless
+    `allow_remove_all` is set.
+    """
+    if not os.path.isdir(data_folder):
+        raise FileNotFoundError(f"Data folder not found: {data_folder}")
+    config = read_yaml_as_dict(config_path)
+    enabled, export_path = tracing_options(config)
+    with start_trace("ingest_pdfs", enabled=enabled, export_path=export_path, data_folder=data_folder):
+        return _ingest_pdfs(data_folder, config_path, config, progress or (lambda done, total, message: None),
+                            allow_remove_all)
+
+def _ingest_pdfs(data_folder, config_path, config, progress, allow_remove_all):
+    persist_dir = config["chroma"]["persist_directory"]
+    ingest_config = {**DEFAULT_INGEST_CONFIG, **config.get("ingest", {})}
+    manifest_path = _manifest_path(config, persist_dir)
+    start = time.monotonic()
+
+    embedding = None
+    vectordb = None
+    backfilled = 0
+    manifest = _load_manifest(manifest_path)
+    if manifest is None:
+        embedding = get_embedding_model(config_path)
+        vectordb = Chroma(persist_directory=persist_dir, embedding_function=embedding)
+        manifest = _bootstrap_manifest(vectordb, data_folder)
+        # a store this old predates the `agency` field the retriever filters on
+        backfilled = backfill_agency(vectordb._collection)
+        if backfilled:
+            print(f"Added agency metadata to {backfilled} existing chunks")
+
+    lexical = get_lexical_index(config)
+    if backfilled and lexical.count():
+        lexical.backfill(vectordb._collection)
+    if manifest and lexical.count() == 0:
+        # store ingested before the lexical index existed
+        if vectordb is None:
+            embedding = get_embedding_model(config_path)
+            vectordb = Chroma(persist_directory=persist_dir, embedding_function=embedding)
+        print(f"Lexical index built from {lexical.backfill(vectordb._collection)} existing chunks")
+
+    # Compare the files on disk with the manifest
+    pending_files = []
+    seen = set()
     for root, dirs, files in os.walk(data_folder):
         for file in files:
-            if file.endswith(".pdf"):
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, data_folder)
-                
-                # Skip if file is already processed
-                if file in already_processed:
-                    print(f"Skipping already processed file: {relative_path}")
-                    continue
-                
-                max_retries = 2
-                for attempt in range(max_retries + 1):
+            if not file.endswith(".pdf"):
+                continue
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(file_path, data_folder)
+            seen.add(relative_path)
+
+            stat = os.stat(file_path)
+            entry = manifest.get(relative_path)
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+                continue
+
+            file_hash = _file_sha256(file_path)
+            if entry and entry.get("sha256") == file_hash:
+                # touched but not modified
+                entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                continue
+
+            fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_hash}
+            pending_files.append((file_path, relative_path, fingerprint))
+
+    removed_files = sorted(set(manifest) - seen)
+    if removed_files and not seen and not allow_remove_all:
+        raise ValueError(
+            f"No PDFs found under {data_folder}, which would remove all {len(removed_files)} indexed files; "
+            "check the path, or pass allow_remove_all=True to empty the index"
+        )
+    print(f"Files: {len(seen)} on disk, {len(pending_files)} new or modified, {len(removed_files)} removed")
+    summary = {"files": len(seen), "updated": 0, "removed": len(removed_files), "failed": [], "chunks": 0}
+
+    if not pending_files and not removed_files:
+        _save_manifest(manifest_path, manifest)
+        _sync_numpy_store(config, config_path, vectordb, changed=bool(backfilled))
+        if backfilled:
+            invalidate_clients(config_path)
+        print("Index is up to date.")
+        progress(0, 0, "Index is up to date.")
+        return summary
+
+    if vectordb is None:
+        embedding = get_embedding_model(config_path)
+        vectordb = Chroma(persist_directory=persist_dir, embedding_function=embedding)
+
+    limiter = RateLimiter(ingest_config["tokens_per_minute"])
+    writes = queue.Queue()
+    written, failed = [], []
+    writer = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(_chroma_writer, vectordb, lexical, writes, manifest, manifest_path, ingest_config["write_batch_size"], written, failed),
+        daemon=True
+    )
+    writer.start()
+
+    for relative_path in removed_files:
+        writes.put(("delete", relative_path))
+
+    try:
+        # spawn, not fork: ingest runs on a job thread inside a heavily threaded app process,
+        # and forked workers would inherit whatever locks its other threads hold
+        with ProcessPoolExecutor(max_workers=ingest_config["parse_workers"],
+                                 mp_context=multiprocessing.get_context("spawn")) as parse_pool, \
+                ThreadPoolExecutor(max_workers=ingest_config["embed_workers"]) as embed_pool:
+            stages = {}
+            for file_path, relative_path, fingerprint in pending_files:
+                print(f"Processing: {relative_path}")
+                future = parse_pool.submit(_load_and_split, file_path, relative_path, fingerprint["sha256"])
+                stages[future] = ("parse", relative_path, fingerprint, None)
+
+            # Hand each file to the next stage as soon as its current stage finishes
+            in_flight = set(stages)
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                progress(len(written) + len(failed), len(pending_files), f"{len(written)} of {len(pending_files)} files indexed")
+                for future in done:
+                    stage, relative_path, fingerprint, parsed = stages.pop(future)
                     try:
-                        print(f"Processing: {relative_path} (attempt {attempt + 1})")
-                        
-                        loader = PyPDFLoader(file_path)
-                        docs = loader.load()
-                        chunks = splitter.split_documents(docs)
-                        for c in chunks:
-                            c.metadata["source"] = file
-                            c.metadata["folder"] = os.path.dirname(relative_path) if os.path.dirname(relative_path) else "root"
-                        
-                        print(f"  PDF loaded and split into {len(chunks)} chunks, now creating embeddings...")
-                        
-                        
-                        if all_chunks: 
-                            existing_db = Chroma(persist_directory=persist_dir, embedding_function=embedding)
-                            existing_db.add_documents(chunks)
-                            existing_db.persist()
-                        else:  # First file, create new database
-                            vectordb = Chroma.from_documents(chunks, embedding=embedding, persist_directory=persist_dir)
-                            vectordb.persist()
-                        
-                        all_chunks.extend(chunks)
-                        print(f"Successfully processed {relative_path} ({len(chunks)} chunks)")
-                        break 
-                        
+                        result = future.result()
                     except Exception as e:
-                        error_msg = str(e)
-                        print(f"Error processing {relative_path} (attempt {attempt + 1}): {error_msg}")
-                        
-                        if "429" in error_msg or "rate limit" in error_msg.lower():
-                            print(f"  Rate limit detected! This is attempt {attempt + 1} of {max_retries + 1}")
-                            if attempt < max_retries:
-                                print(f"  Waiting 60 seconds before retry...")
-                                time.sleep(60)
-                            else:
-                                print(f"  Failed after {max_retries + 1} attempts due to rate limiting")
-                        else:
-                            print(f"  Non-rate-limit error. This is attempt {attempt + 1} of {max_retries + 1}")
-                            if attempt < max_retries:
-                                print(f"  Waiting 60 seconds before retry...")
-                                time.sleep(60)
-                            else:
-                                print(f"  Failed after {max_retries + 1} attempts")
-                        
-                        if attempt == max_retries:
-                            print(f"Failed to process {relative_path} after {max_retries + 1} attempts")
-                
-                print("Waiting 30 seconds before next file...")
-                time.sleep(30)
-
-    if all_chunks:
-        print(f"Processing complete. Total chunks processed: {len(all_chunks)}")
+                        failed.append(relative_path)
+                        print(f"Error {'parsing' if stage == 'parse' else 'embedding'} {relative_path}: {e}")
+                        continue
+
+                    if stage == "parse":
+                        chunks, ids, parse_seconds = result
+                        record_span("ingest.parse", parse_seconds, file=relative_path, chunks=len(chunks))
+                        print(f"  {relative_path} loaded and split into {len(chunks)} chunks, now creating embeddings...")
+                        embed_future = submit_in_context(
+                            embed_pool, _embed_chunks, embedding, chunks, limiter, ingest_config, relative_path
+                        )
+                        stages[embed_future] = ("embed", relative_path, fingerprint, (chunks, ids))
+                        in_flight.add(embed_future)
+                    else:
+                        chunks, ids = parsed
+                        writes.put(("upsert", relative_path, chunks, ids, result, fingerprint))
+    finally:
+        writes.put(None)
+        writer.join()
+        _save_manifest(manifest_path, manifest)
+
+    if hasattr(embedding, "stats"):
+        print(f"Embedding cache: {embedding.stats()}")
+
+    _sync_numpy_store(config, config_path, vectordb, changed=True)
+
+    # drop shared handles so retrieval reopens the updated store
+    invalidate_clients(config_path)
+
+    for relative_path in failed:
+        print(f"Failed to process {relative_path}")
+
+    summary.update(updated=len(written), failed=list(failed), chunks=sum(n for _, n in written))
+    progress(len(written) + len(failed), len(pending_files),
+             f"{len(written)} files indexed, {len(removed_files)} removed, {len(failed)} failed")
+
+    if written or removed_files:
+        print(f"Processing complete. Total chunks processed: {sum(n for _, n in written)} "
+              f"from {len(written)} files, {len(removed_files)} files removed, "
+              f"in {time.monotonic() - start:.1f}s")
         print(f"Vector database updated and persisted to {persist_dir}")
     else:
         print("No PDF chunks found to process.")
+    return summary
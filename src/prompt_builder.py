@@ -0,0 +1,146 @@
+"""
+Token-budgeted context assembly for section prompts.
+
+Retrieved PDF chunks and web snippets are compressed before they go into
+the prompt: near-duplicate chunks are dropped, snippets are cut down to the
+sentences that share the most terms with the section query, and the result
+is packed into a per-section token budget. Every kept chunk and snippet
+keeps its `(Source: ...)` / `(Web Source: ...)` marker so citations can
+still be matched against the response.
+"""
+import re
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+DEFAULT_PROMPT_CONFIG = {
+    "section_token_budget": 2500,
+    "dedupe_threshold": 0.8,
+    "max_snippet_sentences": 3
+}
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have",
+    "in", "is", "it", "of", "on", "or", "our", "that", "the", "this", "to", "we",
+    "with", "use", "uses", "using"
+}
+_WORD = re.compile(r"[a-z0-9]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# the URL runs to the ")" closing its line, so URLs containing ")" stay whole
+_WEB_SNIPPET = re.compile(r"(.*?)\n\(Web Source: ([^\n]*)\)[ \t]*$", re.S | re.M)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Token count with tiktoken when available, otherwise ~4 characters per token."""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _terms(text):
+    return {w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS}
+
+
+def _shingles(text, size=5):
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def dedupe_chunks(chunks, threshold):
+    """
+    Drop chunks whose word 5-shingle Jaccard similarity with an earlier kept
+    chunk is at least `threshold`. `chunks` is a list of (text, source).
+    """
+    kept, kept_shingles = [], []
+    for text, source in chunks:
+        shingles = _shingles(text)
+        if any(len(shingles & other) / max(1, len(shingles | other)) >= threshold for other in kept_shingles):
+            continue
+        kept.append((text, source))
+        kept_shingles.append(shingles)
+    return kept
+
+
+def parse_web_snippets(web_content):
+    """Split the joined web search output back into (content, url) pairs."""
+    snippets = [(m.group(1).strip(), m.group(2)) for m in _WEB_SNIPPET.finditer(web_content)]
+    if not snippets and web_content.strip():
+        # e.g. "Web search failed: ..." with no source marker
+        snippets = [(web_content.strip(), None)]
+    return snippets
+
+
+def trim_snippet(content, query_terms, max_sentences):
+    """Keep the `max_sentences` sentences sharing the most terms with the query, in order."""
+    sentences = [s for s in _SENTENCE_END.split(content) if s.strip()]
+    if len(sentences) <= max_sentences:
+        return content
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(query_terms & _terms(sentences[i])), i)
+    )
+    keep = sorted(ranked[:max_sentences])
+    return " ".join(sentences[i].strip() for i in keep)
+
+
+def build_section_context(query, chunks, web_content, config=None):
+    """
+    Compress retrieved chunks and web snippets into the section token budget.
+
+    `chunks` is a list of (text, source) in retrieval order. Returns
+    (chunks_text, web_text, report) where `report` records what was dropped
+    and how many tokens were saved.
+    """
+    options = {**DEFAULT_PROMPT_CONFIG, **(config or {})}
+    query_terms = _terms(query)
+
+    chunk_items = [f"{text}\n(Source: {source})" for text, source in chunks]
+    web_snippets = parse_web_snippets(web_content)
+    tokens_before = count_tokens("\n\n".join(chunk_items)) + count_tokens(web_content)
+
+    unique_chunks = dedupe_chunks(chunks, options["dedupe_threshold"])
+    chunk_items = [f"{text}\n(Source: {source})" for text, source in unique_chunks]
+
+    snippet_items = []
+    for content, url in web_snippets:
+        trimmed = trim_snippet(content, query_terms, options["max_snippet_sentences"])
+        snippet_items.append(f"{trimmed}\n(Web Source: {url})" if url else trimmed)
+
+    # Fill the budget alternating chunk / snippet in rank order
+    budget = options["section_token_budget"]
+    used = 0
+    kept_chunks, kept_snippets = [], []
+    interleaved = []
+    for i in range(max(len(chunk_items), len(snippet_items))):
+        if i < len(chunk_items):
+            interleaved.append((kept_chunks, chunk_items[i]))
+        if i < len(snippet_items):
+            interleaved.append((kept_snippets, snippet_items[i]))
+    for target, item in interleaved:
+        tokens = count_tokens(item)
+        if used + tokens <= budget:
+            target.append(item)
+            used += tokens
+
+    chunks_text = "\n\n".join(kept_chunks)
+    web_text = "\n\n".join(kept_snippets)
+    tokens_after = count_tokens(chunks_text) + count_tokens(web_text)
+    report = {
+        "context_tokens_before": tokens_before,
+        "context_tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "duplicate_chunks_dropped": len(chunks) - len(unique_chunks),
+        "chunks_dropped_for_budget": len(chunk_items) - len(kept_chunks),
+        "snippets_dropped_for_budget": len(snippet_items) - len(kept_snippets)
+    }
+    return chunks_text, web_text, report
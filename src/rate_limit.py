@@ -0,0 +1,71 @@
+"""
+Rate limiting and provider backoff helpers.
+
+`RateLimiter` is a thread-safe token bucket sized in units per minute
+(tokens for embeddings, requests for chat/search calls). When a provider
+answers 429, `pause()` holds back every caller sharing the limiter for the
+delay the provider asked for, instead of each worker sleeping on its own.
+"""
+import random
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` units per minute across all threads."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Block until `amount` units are available, then consume them."""
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._available >= amount:
+                    self._available -= amount
+                    return
+                else:
+                    wait = (amount - self._available) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds`, e.g. after a 429 response."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._available = 0.0
+
+
+def is_rate_limit_error(error):
+    """True if `error` is an HTTP 429 / rate-limit response from a provider."""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "rate limit" in message.lower()
+
+
+def retry_after_seconds(error, attempt, max_delay=60.0):
+    """
+    Delay before retrying after `error`: the provider's Retry-After header when
+    present, otherwise exponential backoff with jitter.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(max_delay, 2 ** attempt) + random.uniform(0, 1)
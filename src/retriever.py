@@ -1,32 +1,266 @@
-from langchain.vectorstores import Chroma
-from src.utils import get_embedding_model, read_yaml_as_dict
-
-def search_similar_chunks(query, k=5, selected_types=None, config_path="src/config.yaml"):
-    config = read_yaml_as_dict(config_path)
-    persist_dir = config["chroma"]["persist_directory"]
-    embedding = get_embedding_model(config_path)
-
-    vectordb = Chroma(persist_directory=persist_dir, embedding_function=embedding)
-    
-
-    if selected_types:
-
-        retriever = vectordb.as_retriever(search_kwargs={"k": k * 3})
-        all_docs = retriever.get_relevant_documents(query)
-        
-        # filter documents based on file types
-        filtered_docs = []
-        for doc in all_docs:
-            if doc.metadata and 'folder' in doc.metadata:
-                folder = doc.metadata['folder']
-
-                if any(selected_type in folder for selected_type in selected_types):
-                    filtered_docs.append(doc)
-
-                    if len(filtered_docs) >= k:
-                        break
-        
-        return filtered_docs
+import weakref
+import numpy as np
+from langchain_core.documents import Document
+from src.clients import get_config, get_shared_embedding_model, get_vectordb
+from src.lexical_index import get_lexical_index
+from src.numpy_store import get_numpy_store
+from src.tracing import span
+from src.utils import agency_for_folder
+
+# Defaults for the `retrieval` block in config.yaml
+DEFAULT_RETRIEVAL_CONFIG = {
+    "mode": "vector",      # vector | lexical | hybrid (fuses in BM25 hits; opt-in)
+    "backend": "chroma",   # dense search: chroma | numpy (exact, in-process)
+    "candidates": 20,      # per-retriever candidates fused in hybrid mode
+    "rrf_k": 60,
+    "mmr": False,          # re-rank for diversity with maximal marginal relevance
+    "mmr_fetch_k": 20,     # candidates the MMR stage chooses k from
+    "mmr_lambda": 0.5      # 1.0 = relevance only, 0.0 = diversity only
+}
+
+def _query_embeddings(vectordb, query_embeddings, n_results, where=None, include_vectors=False):
+    """
+    One query of the underlying Chroma collection for several query vectors,
+    returning [(docs, ids, vectors or None)] in query order.
+    """
+    include = ["documents", "metadatas", "distances"]
+    if include_vectors:
+        include.append("embeddings")
+
+    result = vectordb._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        where=where,
+        include=include
+    )
+    results = []
+    for i in range(len(query_embeddings)):
+        docs = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(result["documents"][i], result["metadatas"][i])
+        ]
+        vectors = np.asarray(result["embeddings"][i], dtype=np.float32) if include_vectors else None
+        results.append((docs, result["ids"][i], vectors))
+    return results
+
+def agency_filter(selected_types):
+    """Chroma `where` clause restricting results to the selected agencies, or None."""
+    if not selected_types:
+        return None
+    return {"agency": {"$in": [agency.upper() for agency in selected_types]}}
+
+# Agency filter per shared Chroma handle, resolved once per handle
+_agency_filters = weakref.WeakKeyDictionary()
+
+def _agency_where(vectordb, selected_types):
+    """
+    `agency_filter`, or for a store ingested before the `agency` field existed
+    (such as chroma_db12 before `migrate_agency_metadata.py`), the equivalent
+    filter on the stored `folder` values that map to the selected agencies.
+    """
+    if not selected_types:
+        return None
+    agencies = {agency.upper() for agency in selected_types}
+    if vectordb not in _agency_filters:
+        sample = vectordb._collection.get(limit=1, include=["metadatas"])
+        folders = None
+        if sample["ids"] and "agency" not in (sample["metadatas"][0] or {}):
+            stored = vectordb._collection.get(include=["metadatas"])["metadatas"]
+            folders = sorted({(m or {}).get("folder", "") for m in stored})
+            print("Vector store has no `agency` metadata; filtering on folders. "
+                  "Run `python migrate_agency_metadata.py` once to migrate it.")
+        _agency_filters[vectordb] = folders
+    folders = _agency_filters[vectordb]
+    if folders is None:
+        return agency_filter(selected_types)
+    return {"folder": {"$in": [f for f in folders if agency_for_folder(f) in agencies] or [""]}}
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    """Top `k` ids by summed 1 / (rrf_k + rank) over several ranked id lists; ties keep first-seen order."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda chunk_id: -scores[chunk_id])[:k]
+
+def maximal_marginal_relevance(query_vector, vectors, k, lambda_mult=0.5):
+    """
+    Indices of `k` rows of `vectors` chosen greedily by
+    lambda * cos(query, row) - (1 - lambda) * max cos(row, already chosen).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    if k <= 0:
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    relevance = vectors @ (query / max(np.linalg.norm(query), 1e-12))
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+def _mmr(query_vector, result, k, lambda_mult, include_vectors):
+    """Diverse top `k` of an over-fetched (docs, ids, vectors) result, using its stored vectors."""
+    docs, ids, vectors = result
+    if not ids:
+        return result if include_vectors else (docs, ids, None)
+    chosen = maximal_marginal_relevance(query_vector, vectors, k, lambda_mult)
+    return [docs[i] for i in chosen], [ids[i] for i in chosen], vectors[chosen] if include_vectors else None
+
+def _retrieval_config(config_path):
+    return {**DEFAULT_RETRIEVAL_CONFIG, **get_config(config_path).get("retrieval", {})}
+
+def _lexical_results(config_path, query, n_results, selected_types):
+    hits = get_lexical_index(get_config(config_path), create=False).search(query, n_results, selected_types)
+    docs = [Document(page_content=text, metadata=metadata) for _, text, metadata in hits]
+    return docs, [chunk_id for chunk_id, _, _ in hits], None
+
+def _fuse(vector_result, lexical_result, k, rrf_k):
+    """Reciprocal rank fusion of a vector and a lexical (docs, ids, vectors) result."""
+    docs_by_id = {}
+    vectors_by_id = {}
+    for docs, ids, vectors in (lexical_result, vector_result):
+        docs_by_id.update(zip(ids, docs))
+        if vectors is not None:
+            vectors_by_id.update(zip(ids, vectors))
+    fused_ids = reciprocal_rank_fusion([vector_result[1], lexical_result[1]], k, rrf_k)
+    vectors = None
+    if vector_result[2] is not None and all(i in vectors_by_id for i in fused_ids):
+        vectors = np.asarray([vectors_by_id[i] for i in fused_ids], dtype=np.float32)
+    return [docs_by_id[i] for i in fused_ids], fused_ids, vectors
+
+def _fill_vectors(config_path, backend, result):
+    """Attach stored embeddings to a result that lacks them (lexical hits)."""
+    docs, ids, vectors = result
+    if vectors is not None:
+        return result
+    if not ids:
+        return docs, ids, np.zeros((0, 0), dtype=np.float32)
+    if backend == "numpy":
+        return docs, ids, get_numpy_store(get_config(config_path)).get_vectors(ids)
+    stored = get_vectordb(config_path)._collection.get(ids=ids, include=["embeddings"])
+    by_id = dict(zip(stored["ids"], stored["embeddings"]))
+    return docs, ids, np.asarray([by_id[i] for i in ids], dtype=np.float32)
+
+def _dense_results(config_path, backend, queries, n_results, selected_types, include_vectors):
+    """Embed `queries` in one call and run one dense search for all of them; returns (query embeddings, results)."""
+    if backend == "numpy":
+        embeddings = get_shared_embedding_model(config_path)
+    else:
+        vectordb = get_vectordb(config_path)
+        embeddings = vectordb.embeddings
+
+    if len(queries) == 1:
+        query_embeddings = [embeddings.embed_query(queries[0])]
     else:
-        retriever = vectordb.as_retriever(search_kwargs={"k": k})
-        return retriever.get_relevant_documents(query)
+        query_embeddings = embeddings.embed_documents(list(queries))
+
+    if backend == "numpy":
+        store = get_numpy_store(get_config(config_path))
+        return query_embeddings, store.search(query_embeddings, n_results, selected_types, include_vectors)
+    return query_embeddings, _query_embeddings(
+        vectordb,
+        query_embeddings,
+        n_results,
+        where=_agency_where(vectordb, selected_types),
+        include_vectors=include_vectors
+    )
+
+def _search_many(queries, k, selected_types, config_path, include_vectors, mmr=None, mode=None):
+    """
+    Shared retrieval path for one or many queries, by `mode` (default
+    `retrieval.mode`):
+      vector   dense search only (default)
+      lexical  BM25 over the local inverted index; no embedding call
+      hybrid   both, merged with reciprocal rank fusion
+    Dense queries are embedded in one call and searched in one pass over
+    `retrieval.backend`: the Chroma collection, or the exact NumPy export.
+
+    With `mmr` (default `retrieval.mmr`) the vector and hybrid modes fetch
+    `retrieval.mmr_fetch_k` candidates with their stored vectors and keep a
+    diverse k by maximal marginal relevance against the query embedding
+    already computed, so no extra embedding call is made. Lexical mode has
+    no query embedding and is returned unchanged.
+    """
+    # The agency filter runs inside the vector query, so every call returns
+    # k in-agency hits. Stores ingested before the `agency` field existed
+    # need `python migrate_agency_metadata.py` once.
+    options = _retrieval_config(config_path)
+    mode, backend = mode or options["mode"], options["backend"]
+    mmr = (options["mmr"] if mmr is None else mmr) and mode != "lexical"
+    if mode not in ("vector", "lexical", "hybrid"):
+        raise ValueError(f"Unknown retrieval.mode: {mode}")
+    if backend not in ("chroma", "numpy"):
+        raise ValueError(f"Unknown retrieval.backend: {backend}")
+
+    with span("retrieval", k=k, agencies=selected_types or [], queries=len(queries), mode=mode, backend=backend, mmr=mmr) as s:
+        # the MMR stage picks k from a larger pool, so the modes return that many
+        keep = max(k, options["mmr_fetch_k"]) if mmr else k
+        n_results = keep if mode == "vector" else max(keep, options["candidates"])
+        fetch_vectors = include_vectors or mmr
+
+        if mode == "lexical":
+            results = [_lexical_results(config_path, query, k, selected_types) for query in queries]
+        else:
+            query_embeddings, results = _dense_results(config_path, backend, queries, n_results, selected_types, fetch_vectors)
+            if mode == "hybrid":
+                results = [
+                    _fuse(result, _lexical_results(config_path, query, n_results, selected_types), keep, options["rrf_k"])
+                    for query, result in zip(queries, results)
+                ]
+
+        if fetch_vectors:
+            results = [_fill_vectors(config_path, backend, result) for result in results]
+        if mmr:
+            results = [
+                _mmr(query_embedding, result, k, options["mmr_lambda"], include_vectors)
+                for query_embedding, result in zip(query_embeddings, results)
+            ]
+        s.set(results=sum(len(docs) for docs, _, _ in results))
+    return results
+
+def _search(query, k, selected_types, config_path, include_vectors, mmr=None, mode=None):
+    return _search_many([query], k, selected_types, config_path, include_vectors, mmr, mode)[0]
+
+def search_similar_chunks(query, k=5, selected_types=None, config_path="src/config.yaml", mmr=None, mode=None):
+    """
+    Top `k` chunks for `query`; `mmr` and `mode` override `retrieval.mmr`
+    and `retrieval.mode` for this call.
+    """
+    docs, _, _ = _search(query, k, selected_types, config_path, include_vectors=False, mmr=mmr, mode=mode)
+    return docs
+
+def search_similar_chunks_with_ids(query, k=5, selected_types=None, config_path="src/config.yaml", mmr=None, mode=None):
+    """Same results as `search_similar_chunks`, as (docs, chunk IDs)."""
+    docs, ids, _ = _search(query, k, selected_types, config_path, include_vectors=False, mmr=mmr, mode=mode)
+    return docs, ids
+
+def search_similar_chunks_batch(queries, k=5, selected_types=None, config_path="src/config.yaml", mmr=None, mode=None):
+    """
+    `search_similar_chunks_with_ids` for several queries at once: the queries
+    are embedded in one `embed_documents` call and searched with one
+    collection query. Returns [(docs, ids)] in query order.
+    """
+    if not queries:
+        return []
+    results = _search_many(list(queries), k, selected_types, config_path, include_vectors=False, mmr=mmr, mode=mode)
+    return [(docs, ids) for docs, ids, _ in results]
+
+def search_similar_chunks_with_vectors(query, k=5, selected_types=None, config_path="src/config.yaml", mmr=None, mode=None):
+    """
+    Same results as `search_similar_chunks`, plus the chunk IDs and the
+    embeddings already stored in Chroma for them.
+    Returns (docs, ids, vectors) where vectors is a float32 array of shape
+    (len(docs), dim). Only the query itself is embedded.
+    """
+    return _search(query, k, selected_types, config_path, include_vectors=True, mmr=mmr, mode=mode)
@@ -0,0 +1,172 @@
+"""
+Persistent cache of generated sections.
+
+A section is reused when everything that shaped it is unchanged: agency,
+section label, normalized user text, retrieved chunk IDs and their text
+(so re-chunked or re-ingested PDFs miss), web snippets, prompt templates and
+prompt settings, and model name. Everything except the user text forms the
+entry's "scope"; with `similarity_threshold` set, a miss on the exact key
+falls back to the most similar cached user text within the same scope.
+
+Entries live in SQLite with a time-to-live and a size bound; the least
+recently used entries are evicted first.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from src.web_cache import normalize_query
+
+DEFAULT_SECTION_CACHE_CONFIG = {
+    "enabled": True,
+    "path": "section_cache.sqlite3",
+    "ttl_seconds": 7 * 24 * 3600,
+    "max_entries": 2000,
+    "similarity_threshold": None
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def section_cache_scope(selected_types, section, chunk_ids, chunk_texts, web_content, model_name, prompt_version):
+    """Hash of every cache-key component except the user text."""
+    payload = json.dumps({
+        "agency": sorted(agency.upper() for agency in selected_types or []),
+        "section": section,
+        "chunk_ids": list(chunk_ids),
+        "corpus": _sha256("\0".join(chunk_texts)),
+        "web": _sha256(web_content),
+        "model": model_name,
+        "prompt": _sha256(json.dumps(prompt_version, sort_keys=True))
+    }, sort_keys=True)
+    return _sha256(payload)
+
+
+class SectionCache:
+    """SQLite-backed (scope, user text) -> generated section cache."""
+
+    def __init__(self, path, ttl_seconds, max_entries, similarity_threshold=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sections ("
+            " key TEXT PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " embedding BLOB,"
+            " response TEXT NOT NULL,"
+            " sources TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sections_scope ON sections (scope)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sections_lru ON sections (last_access)")
+        self._conn.commit()
+
+    def _key(self, scope, user_text):
+        return _sha256(f"{scope}\n{normalize_query(user_text)}")
+
+    def _similar(self, scope, embedding, now):
+        rows = self._conn.execute(
+            "SELECT key, embedding FROM sections WHERE scope = ? AND embedding IS NOT NULL AND created >= ?",
+            (scope, now - self.ttl_seconds)
+        ).fetchall()
+        if not rows:
+            return None
+        vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+        query = np.asarray(embedding, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        scores = vectors @ query / np.where(norms == 0, 1, norms)
+        best = int(np.argmax(scores))
+        return rows[best][0] if scores[best] >= self.similarity_threshold else None
+
+    def get(self, scope, user_text, embedding=None):
+        """
+        Cached (response, sources) for this scope and user text, or None.
+        `embedding` of the user text enables the similarity fallback.
+        """
+        now = time.time()
+        key = self._key(scope, user_text)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, sources, created FROM sections WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM sections WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None and embedding is not None and self.similarity_threshold is not None:
+                key = self._similar(scope, embedding, now)
+                if key is not None:
+                    row = self._conn.execute(
+                        "SELECT response, sources, created FROM sections WHERE key = ?", (key,)
+                    ).fetchone()
+                    self.similar_hits += 1
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE sections SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0], json.loads(row[1])
+
+    def put(self, scope, user_text, response, sources, embedding=None):
+        now = time.time()
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sections (key, scope, embedding, response, sources, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(scope, user_text), scope, blob, response, json.dumps(sources), now, now)
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM sections").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM sections WHERE key IN "
+                    "(SELECT key FROM sections ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM sections").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": entries
+            }
+
+
+def get_section_cache(config):
+    """Shared cache for the `section_cache` block of `config`, or None when disabled."""
+    cache_config = {**DEFAULT_SECTION_CACHE_CONFIG, **config.get("section_cache", {})}
+    if not cache_config["enabled"]:
+        return None
+
+    with _caches_lock:
+        if cache_config["path"] not in _caches:
+            _caches[cache_config["path"]] = SectionCache(
+                cache_config["path"],
+                cache_config["ttl_seconds"],
+                cache_config["max_entries"],
+                cache_config["similarity_threshold"]
+            )
+        return _caches[cache_config["path"]]
@@ -0,0 +1,224 @@
+"""
+Lightweight per-stage tracing for the generation and ingest paths.
+
+A trace is opened with `start_trace(...)`; inside it, `span(name, **attrs)`
+records a timed, nested span carrying whatever attributes the caller sets
+(result counts, token counts, cache hits). Finished traces can be exported
+as JSON lines with OTLP-style fields, one span per line.
+
+When no trace is active, `span()` returns a shared no-op object after a
+single context-variable lookup, so instrumentation is nearly free when
+tracing is disabled. Worker threads do not inherit context variables, so
+work fanned out to a pool should be submitted with `submit_in_context`.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span_id = contextvars.ContextVar("current_span_id", default=None)
+
+
+class Trace:
+    """Thread-safe collection of finished spans for one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def export(self, path):
+        """Append every span to `path` as one JSON object per line."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(path, "a") as f:
+            for record in self.spans:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self):
+        """Spans ordered by start time, for display."""
+        with self._lock:
+            return sorted(self.spans, key=lambda r: r["start_time_unix_nano"])
+
+
+class Span:
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = dict(attributes)
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._parent_id = _current_span_id.get()
+        self._token = _current_span_id.set(self.span_id)
+        self._start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        _current_span_id.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = repr(exc)
+        self.trace.add({
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self._parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self._start_ns,
+            "end_time_unix_nano": self._start_ns + int(duration * 1e9),
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": self.attributes
+        })
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _TraceScope:
+    def __init__(self, name, export_path, attributes):
+        self.trace = Trace(name)
+        self.export_path = export_path
+        self.root = Span(self.trace, name, attributes)
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        self.root.__enter__()
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self.root.__exit__(exc_type, exc, tb)
+        _current_trace.reset(self._token)
+        if self.export_path:
+            self.trace.export(self.export_path)
+        return False
+
+
+class _NoopTraceScope:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _ChildScope:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.child.__enter__()
+        return _current_trace.get()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self.child.__exit__(exc_type, exc, tb)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def span(name, **attributes):
+    """Timed child span of the active trace, or a no-op when none is active."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return Span(trace, name, attributes)
+
+
+def record_span(name, duration_seconds, **attributes):
+    """Record an already-measured span (e.g. timed in another process)."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    end_ns = time.time_ns()
+    trace.add({
+        "trace_id": trace.trace_id,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_span_id": _current_span_id.get(),
+        "name": name,
+        "start_time_unix_nano": end_ns - int(duration_seconds * 1e9),
+        "end_time_unix_nano": end_ns,
+        "duration_ms": round(duration_seconds * 1000, 3),
+        "attributes": attributes
+    })
+
+
+def start_trace(name, enabled=True, export_path=None, **attributes):
+    """
+    Open a trace yielding the `Trace` (or None when disabled). Inside an
+    active trace this just opens a child span, so callers can nest freely.
+    """
+    if not enabled:
+        return _NoopTraceScope()
+    if _current_trace.get() is not None:
+        return _ChildScope(span(name, **attributes))
+    return _TraceScope(name, export_path, attributes)
+
+
+def tracing_options(config):
+    """(enabled, export_path) from the `tracing` block of config.yaml."""
+    tracing_config = config.get("tracing", {})
+    return tracing_config.get("enabled", False), tracing_config.get("export_path", "traces.jsonl")
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """`executor.submit` that runs `fn` inside a copy of the caller's trace context."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def token_usage(message):
+    """Prompt/completion/cached token counts reported on an LLM response message."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    metadata = getattr(message, "response_metadata", None) or {}
+    token_counts = metadata.get("token_usage") or metadata.get("usage") or {}
+    prompt_details = token_counts.get("prompt_tokens_details") or {}
+    input_details = usage.get("input_token_details") or {}
+    return {
+        "prompt_tokens": usage.get("input_tokens", token_counts.get("prompt_tokens")),
+        "completion_tokens": usage.get("output_tokens", token_counts.get("completion_tokens")),
+        "cached_tokens": input_details.get("cache_read", prompt_details.get("cached_tokens"))
+    }
+
+
+def timing_rows(spans):
+    """Flatten exported spans into display rows, tagging each with its section."""
+    by_id = {record["span_id"]: record for record in spans}
+    rows = []
+    for record in spans:
+        section, parent = None, record
+        while parent is not None and section is None:
+            section = parent["attributes"].get("section")
+            parent = by_id.get(parent["parent_span_id"])
+        details = {k: v for k, v in record["attributes"].items() if k != "section" and v is not None}
+        rows.append({
+            "stage": record["name"],
+            "section": section or "",
+            "duration (ms)": record["duration_ms"],
+            "details": ", ".join(f"{k}={v}" for k, v in details.items())
+        })
+    return rows
@@ -1,13 +1,44 @@
 import yaml
 from portkey_ai import createHeaders
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from src.embedding_cache import CachedEmbeddings
+from src.local_backends import FakeChatModel, FixtureSearchClient, HashingEmbeddings
+
+KNOWN_AGENCIES = ["NSF", "NIH"]
 
 def read_yaml_as_dict(file_path):
     with open(file_path, 'r') as file:
         return yaml.safe_load(file)
 
+def get_backend(config, kind):
+    """
+    Backend selected for `kind` ("llm", "embeddings" or "web_search") in the
+    `backends` block of config.yaml. Defaults to the hosted services.
+    """
+    defaults = {"llm": "portkey", "embeddings": "portkey", "web_search": "tavily"}
+    return config.get("backends", {}).get(kind, defaults[kind])
+
+def agency_for_folder(folder):
+    """
+    Normalized funding agency for a data folder ("NSF", "NSF/2023" -> "NSF").
+    Folders without a known agency map to their top-level name, upper-cased.
+    """
+    folder = (folder or "").upper()
+    for agency in KNOWN_AGENCIES:
+        if agency in folder:
+            return agency
+    top_level = folder.replace("\\", "/").split("/")[0]
+    return top_level or "ROOT"
+
 def get_llm(config_path="src/config.yaml", model_name="gpt-4o"):
     config = read_yaml_as_dict(config_path)
+    if get_backend(config, "llm") == "fake":
+        local = config.get("local_backends", {})
+        return FakeChatModel(
+            first_token_latency=local.get("llm_first_token_latency", 0.5),
+            token_latency=local.get("llm_token_latency", 0.01)
+        )
+
     headers = createHeaders(
         api_key=config["portkey"]["chat"]["api_key"],
         virtual_key=config["portkey"]["chat"]["openai_virtual_key"]
@@ -21,16 +52,25 @@ def get_llm(config_path="src/config.yaml", model_name="gpt-4o"):
 
 def get_embedding_model(config_path="src/config.yaml"):
     config = read_yaml_as_dict(config_path)
+    if get_backend(config, "embeddings") == "hashing":
+        return HashingEmbeddings(config.get("local_backends", {}).get("embedding_dimensions", 1536))
+
     headers = createHeaders(
         api_key=config["portkey"]["embeddings"]["api_key"],
         virtual_key=config["portkey"]["embeddings"]["virtual_key"]
     )
-    return OpenAIEmbeddings(
+    embeddings = OpenAIEmbeddings(
         api_key="unused",
         base_url=config["portkey"]["base_url"],
         default_headers=headers
     )
 
+    # Serve previously embedded text from the on-disk cache unless disabled
+    cache_config = config.get("embedding_cache", {})
+    if not cache_config.get("enabled", True):
+        return embeddings
+    return CachedEmbeddings(embeddings, cache_config.get("path", "embedding_cache.sqlite3"))
+
 from langchain.tools.tavily_search import TavilySearchResults
 from langchain_community.tools.tavily_search import TavilySearchResults
 from tavily import TavilyClient  
@@ -39,17 +79,102 @@ from tavily import TavilyClient
 
 
 
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from tavily import TavilyClient
 from src.utils import read_yaml_as_dict
+from src.web_cache import get_web_search_cache, web_search_cache_key
+from src.tracing import span, submit_in_context
+
+# Site-restricted searches for every section share one pool and one client per key
+DEFAULT_SEARCH_TIMEOUT_SECONDS = 20
+_search_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="web-search")
+_tavily_clients = {}
+_tavily_clients_lock = threading.Lock()
+
+def get_tavily_client(api_key):
+    """Return the process-wide TavilyClient for `api_key`."""
+    with _tavily_clients_lock:
+        if api_key not in _tavily_clients:
+            _tavily_clients[api_key] = TavilyClient(api_key=api_key)
+        return _tavily_clients[api_key]
+
+def get_search_client(config):
+    """
+    Search client for the configured web_search backend, or None when web
+    search is unavailable (no Tavily API key).
+    """
+    if get_backend(config, "web_search") == "fixture":
+        local = config.get("local_backends", {})
+        fixture_path = local.get("web_fixture_path", "src/fixtures/web_search.json")
+        with _tavily_clients_lock:
+            if fixture_path not in _tavily_clients:
+                _tavily_clients[fixture_path] = FixtureSearchClient(
+                    fixture_path, local.get("web_search_latency", 0.0)
+                )
+            return _tavily_clients[fixture_path]
+
+    api_key = config.get("tavily", {}).get("TAVILY_API_KEY")
+    if not api_key:
+        return None
+    return get_tavily_client(api_key)
+
+def _site_search(client, site, query, cache, timeout, search_depth="advanced", max_results=3):
+    """
+    Run one site-restricted Tavily search, serving repeats from `cache`.
+    `timeout` bounds the HTTP request itself, so a hung call frees its pool worker.
+    """
+    with span("web_search.site", site=site) as s:
+        key = web_search_cache_key(query, site, search_depth=search_depth, max_results=max_results)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                s.set(cache_hit=True, results=len(cached))
+                return cached
+
+        response = client.search(
+            query=f"site:{site} {query}",
+            search_depth=search_depth,
+            max_results=max_results,
+            timeout=timeout
+        )
+        results = response.get("results", [])
+        if cache is not None:
+            cache.put(key, results)
+        s.set(cache_hit=False, results=len(results))
+        return results
+
+def _search_sites(client, query, sites, config):
+    """
+    Search every site concurrently. Returns (site, results, error) in `sites`
+    order; a site that fails or exceeds `tavily.timeout_seconds` only loses
+    its own results.
+    """
+    cache = get_web_search_cache(config)
+    timeout = config.get("tavily", {}).get("timeout_seconds", DEFAULT_SEARCH_TIMEOUT_SECONDS)
+
+    futures = [submit_in_context(_search_executor, _site_search, client, site, query, cache, timeout) for site in sites]
+    # the request timeout releases the worker; this bounds the wait for queued searches too
+    wait(futures, timeout=timeout)
+
+    outcomes = []
+    for site, future in zip(sites, futures):
+        if not future.done():
+            future.cancel()
+            outcomes.append((site, [], TimeoutError(f"search of {site} timed out after {timeout}s")))
+        elif future.exception() is not None:
+            outcomes.append((site, [], future.exception()))
+        else:
+            outcomes.append((site, future.result(), None))
+    return outcomes
 
 def limited_web_search(query: str, config_path="src/config.yaml") -> tuple[str, list[str]]:
     config = read_yaml_as_dict(config_path)
-    api_key = config.get("tavily", {}).get("TAVILY_API_KEY")
+    client = get_search_client(config)
 
-    if not api_key:
+    if client is None:
         return "", []
 
-    client = TavilyClient(api_key=api_key)
     snippets = []
     urls = []
 
@@ -61,29 +186,23 @@ def limited_web_search(query: str, config_path="src/config.yaml") -> tuple[str,
         "https://med.nyu.edu/research/scientific-cores-shared-resources/high-performance-computing-core"
     ]
 
-    try:
-        for domain in allowed_domains:
-            response = client.search(
-                query=f"site:{domain} {query}",
-                search_depth="advanced",
-                max_results=3
-            )
-            for r in response.get("results", []):
-                url = r.get("url", "").strip()
-                content = r.get("content", "").strip()
-
-                parsed_domain = urlparse(url).netloc  
-                
-                if (
-                    any(allowed in parsed_domain for allowed in allowed_domains)
-                    and not any(url.startswith(bad) for bad in blocklist)
-                ):
-                    snippets.append(f"{content}\n(Web Source: {url})")
-                    urls.append(url)
-
-
-    except Exception as e:
-        snippets.append(f"Web search failed: {e}")
+    for domain, results, error in _search_sites(client, query, allowed_domains, config):
+        if error is not None:
+            snippets.append(f"Web search failed: {error}")
+            continue
+
+        for r in results:
+            url = r.get("url", "").strip()
+            content = r.get("content", "").strip()
+
+            parsed_domain = urlparse(url).netloc  
+            
+            if (
+                any(allowed in parsed_domain for allowed in allowed_domains)
+                and not any(url.startswith(bad) for bad in blocklist)
+            ):
+                snippets.append(f"{content}\n(Web Source: {url})")
+                urls.append(url)
 
     return "\n\n".join(snippets), urls
 
@@ -93,32 +212,26 @@ def limited_web_search_specific_sites(query: str, allowed_sites: list[str], conf
     Only include snippets and URLs from the exact allowed domains.
     """
     config = read_yaml_as_dict(config_path)
-    api_key = config.get("tavily", {}).get("TAVILY_API_KEY")
+    client = get_search_client(config)
 
-    if not api_key:
+    if client is None:
         return "", []
 
-    client = TavilyClient(api_key=api_key)
     snippets = []
     urls = []
 
-    try:
-        for site in allowed_sites:
-            response = client.search(
-                query=f"site:{site} {query}",
-                search_depth="advanced",
-                max_results=3
-            )
-            for r in response.get("results", []):
-                url = r.get("url", "")
-                content = r.get("content", "").strip()
-
-                if any(url.startswith(s) for s in allowed_sites):
-                    # Optional: You can filter the snippet content if needed
-                    snippets.append(f"{content}\n(Web Source: {url})")
-                    urls.append(url)
-
-    except Exception as e:
-        snippets.append(f"Web search failed: {e}")
+    for site, results, error in _search_sites(client, query, allowed_sites, config):
+        if error is not None:
+            snippets.append(f"Web search failed: {error}")
+            continue
+
+        for r in results:
+            url = r.get("url", "")
+            content = r.get("content", "").strip()
+
+            if any(url.startswith(s) for s in allowed_sites):
+                # Optional: You can filter the snippet content if needed
+                snippets.append(f"{content}\n(Web Source: {url})")
+                urls.append(url)
 
     return "\n\n".join(snippets), urls
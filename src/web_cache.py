@@ -0,0 +1,120 @@
+"""
+Persistent cache for Tavily web search results.
+
+Results are stored per (normalized query, site, search parameters) in SQLite
+with a time-to-live and a size bound; the least recently used entries are
+evicted first. Re-submitting an unchanged draft then skips the paid searches.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_WEB_CACHE_CONFIG = {
+    "enabled": True,
+    "path": "web_search_cache.sqlite3",
+    "ttl_seconds": 7 * 24 * 3600,
+    "max_entries": 5000
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of `query` used for cache keys."""
+    return " ".join(query.lower().split())
+
+
+def web_search_cache_key(query, site, **search_params):
+    payload = json.dumps(
+        {"query": normalize_query(query), "site": site.strip().lower(), **search_params},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class WebSearchCache:
+    """SQLite-backed query -> results cache with TTL and LRU eviction."""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS web_results ("
+            " key TEXT PRIMARY KEY,"
+            " results TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS web_results_lru ON web_results (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Cached results for `key`, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, created FROM web_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM web_results WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE web_results SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, results):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO web_results (key, results, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(results), now, now)
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM web_results").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM web_results WHERE key IN "
+                    "(SELECT key FROM web_results ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM web_results").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries
+            }
+
+
+def get_web_search_cache(config):
+    """Shared cache for the `web_cache` block of `config`, or None when disabled."""
+    cache_config = {**DEFAULT_WEB_CACHE_CONFIG, **config.get("web_cache", {})}
+    if not cache_config["enabled"]:
+        return None
+
+    with _caches_lock:
+        if cache_config["path"] not in _caches:
+            _caches[cache_config["path"]] = WebSearchCache(
+                cache_config["path"],
+                cache_config["ttl_seconds"],
+                cache_config["max_entries"]
+            )
+        return _caches[cache_config["path"]]
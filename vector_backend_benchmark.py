@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+from pipeline_benchmark import current_commit, summarize
+from src.clients import get_vectordb
+from src.numpy_store import NumpyStore, export_numpy_store, write_numpy_store
+
+AGENCIES = ["NSF", "NIH"]
+
+def make_queries(vectors, n, seed=0):
+    """Queries near stored vectors (a perturbed copy of random rows), so results are realistic"""
+    rng = np.random.default_rng(seed)
+    rows = vectors[rng.integers(0, len(vectors), size=n)]
+    queries = rows + rng.normal(scale=0.5 / np.sqrt(vectors.shape[1]), size=rows.shape)
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+def time_backends(collection, store, queries, k, agency=None):
+    """Per-query latency and recall@k of Chroma (HNSW) against the exact NumPy search"""
+    chroma_samples, numpy_samples, recalls = [], [], []
+    where = {"agency": {"$in": [agency]}} if agency else None
+    for query in queries:
+        start = time.perf_counter()
+        chroma_ids = collection.query(
+            query_embeddings=[query.tolist()],
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )["ids"][0]
+        chroma_samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _, exact_ids, _ = store.search([query], k, [agency] if agency else None)[0]
+        numpy_samples.append(time.perf_counter() - start)
+
+        recalls.append(len(set(chroma_ids) & set(exact_ids)) / max(1, len(exact_ids)))
+    return {
+        "chroma": summarize(chroma_samples),
+        "numpy": summarize(numpy_samples),
+        "chroma_recall_at_k": round(float(np.mean(recalls)), 4)
+    }
+
+def benchmark_real_corpus(config_path, n_queries, k):
+    """Both backends over the configured store, e.g. chroma_db12"""
+    collection = get_vectordb(config_path)._collection
+    export_dir = tempfile.mkdtemp(prefix="numpy_store_")
+    try:
+        start = time.perf_counter()
+        export_numpy_store(collection, export_dir)
+        export_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = NumpyStore(export_dir)
+        load_seconds = time.perf_counter() - start
+
+        agency = max(AGENCIES, key=lambda a: int((store.agencies == a).sum()))
+        queries = make_queries(np.asarray(store.vectors), n_queries)
+        results = time_backends(collection, store, queries, k, agency)
+        results.update(
+            chunks=len(store.ids),
+            agency=agency,
+            export_seconds=round(export_seconds, 3),
+            numpy_load_ms=round(load_seconds * 1000, 2)
+        )
+        return results
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+def benchmark_synthetic(size, dimensions, n_queries, k, seed=0):
+    """Both backends over `size` random unit vectors, split across agencies"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(size, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"chunk-{i}" for i in range(size)]
+    metadatas = [{"agency": AGENCIES[i % len(AGENCIES)]} for i in range(size)]
+    documents = [""] * size
+
+    workdir = tempfile.mkdtemp(prefix="vector_backends_")
+    try:
+        client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"), settings=Settings(anonymized_telemetry=False))
+        collection = client.create_collection("benchmark")
+        step = client.get_max_batch_size() if hasattr(client, "get_max_batch_size") else 5000
+        start = time.perf_counter()
+        for i in range(0, size, step):
+            collection.add(
+                ids=ids[i:i + step],
+                embeddings=vectors[i:i + step].tolist(),
+                metadatas=metadatas[i:i + step],
+                documents=documents[i:i + step]
+            )
+        build_seconds = time.perf_counter() - start
+
+        write_numpy_store(os.path.join(workdir, "numpy"), ids, documents, metadatas, vectors)
+        store = NumpyStore(os.path.join(workdir, "numpy"))
+
+        # the app always filters by agency; unfiltered queries show raw HNSW vs scan cost
+        queries = make_queries(vectors, n_queries, seed + 1)
+        return {
+            "chunks": size,
+            "chroma_build_seconds": round(build_seconds, 2),
+            "agency_filter": time_backends(collection, store, queries, k, AGENCIES[0]),
+            "no_filter": time_backends(collection, store, queries, k)
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_vector_backend_benchmark(config_path="src/config.yaml", sizes=(1000, 5000, 10000, 25000, 50000),
+                                 dimensions=1536, n_queries=100, k=5, filename="vector_backend_benchmark.json"):
+    """Compare Chroma and the exact NumPy backend, and find where HNSW starts to win"""
+
+    print("=" * 80)
+    print("VECTOR BACKEND BENCHMARK")
+    print("=" * 80)
+
+    print("  Configured store...")
+    real = benchmark_real_corpus(config_path, n_queries, k)
+
+    synthetic = []
+    for size in sizes:
+        print(f"  Synthetic corpus: {size} x {dimensions}...")
+        synthetic.append(benchmark_synthetic(size, dimensions, n_queries, k))
+
+    # smallest corpus where Chroma's median query beats the exact scan
+    crossover = {
+        kind: next(
+            (run["chunks"] for run in synthetic if run[kind]["chroma"]["p50_ms"] < run[kind]["numpy"]["p50_ms"]),
+            None
+        )
+        for kind in ("agency_filter", "no_filter")
+    }
+
+    results = {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config_path": config_path,
+        "k": k,
+        "queries": n_queries,
+        "dimensions": dimensions,
+        "configured_store": real,
+        "synthetic": synthetic,
+        "crossover_chunks": crossover
+    }
+
+    # FINAL SUMMARY
+    print(f"\n" + "=" * 80)
+    print("FINAL SUMMARY")
+    print("=" * 80)
+    print(f"Configured store ({real['chunks']} chunks, {real['agency']}): "
+          f"chroma p50 {real['chroma']['p50_ms']} ms, numpy p50 {real['numpy']['p50_ms']} ms, "
+          f"chroma recall@{k} {real['chroma_recall_at_k']}")
+    for kind in ("agency_filter", "no_filter"):
+        print(f"\n{kind.replace('_', ' ').capitalize()}:")
+        print(f"{'chunks':>8} {'chroma p50':>12} {'numpy p50':>12} {'chroma recall':>14}")
+        for run in synthetic:
+            row = run[kind]
+            print(f"{run['chunks']:>8} {row['chroma']['p50_ms']:>9} ms {row['numpy']['p50_ms']:>9} ms {row['chroma_recall_at_k']:>14}")
+        if crossover[kind]:
+            print(f"HNSW (Chroma) is faster from about {crossover[kind]} chunks; below that the exact NumPy scan wins.")
+        else:
+            print(f"The exact NumPy scan was faster at every size tested (up to {max(sizes)} chunks).")
+
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results saved to: {filename}")
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chroma (HNSW) vs exact NumPy retrieval latency and crossover")
+    parser.add_argument("--config", default="src/config.yaml", help="config file, e.g. src/config.local.yaml for offline runs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000, 25000, 50000], help="synthetic corpus sizes")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", default="vector_backend_benchmark.json", help="where to write the JSON results")
+    args = parser.parse_args()
+    run_vector_backend_benchmark(args.config, args.sizes, args.dimensions, args.queries, args.k, args.output)